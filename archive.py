@@ -0,0 +1,79 @@
+import argparse
+import os
+
+from lib.analysis import INPUT_DTAU
+from lib.archive import (
+    ARCHIVE_SUFFIX,
+    archive_matches,
+    is_archive,
+    read_archive_header,
+    write_archive,
+)
+from lib.read_file import read_trace_auto
+
+"""
+把跑完的 trace 文本文件转换成列式归档（见 lib/archive.py），之后各个分析脚本可以直接读取归档
+    archive.py trace.txt              写出 trace.txt.qtr
+    archive.py trace.txt --info       只显示已有归档的 header
+    archive.py trace.txt --verify     检查归档与 trace 文件的 sha256 是否一致
+"""
+
+
+def add_arguments(parser):
+    parser.add_argument("file", help="Trace file, or an archive with --info")
+    parser.add_argument(
+        "--output", default=None, help=f"Archive file, default <file>{ARCHIVE_SUFFIX}"
+    )
+    parser.add_argument(
+        "--dtau", type=float, default=INPUT_DTAU, help="dtau of the FCIQMC input"
+    )
+    parser.add_argument("--info", action="store_true", help="Show the archive header")
+    parser.add_argument(
+        "--verify", action="store_true", help="Check the archive against the trace"
+    )
+
+
+# 显示 header 中的主要信息
+def print_header(filename, header):
+    print(f"{filename}: {header['trace_type']} trace")
+    print(f"  states = {header['nstates']}, steps = {header['nsteps']}")
+    print(f"  first step = {header['first_step']}, interval = {header['interval']}")
+    print(f"  dtau = {header['dtau']}")
+    observables = [name for name in header["columns"] if name != "steps"]
+    print(f"  observables = {', '.join(observables)}")
+    source = header.get("source")
+    if source is not None:
+        print(f"  source = {source['path']} ({source['size']} bytes)")
+        print(f"  sha256 = {source['sha256']}")
+
+
+def main(args):
+    filename = args.file
+    output = args.output or filename + ARCHIVE_SUFFIX
+
+    if args.info:
+        target = filename if is_archive(filename) else output
+        print_header(target, read_archive_header(target))
+        return
+
+    if args.verify:
+        if not os.path.isfile(output):
+            raise SystemExit(f"归档 {output} 不存在")
+        if archive_matches(output, filename):
+            print(f"{output} 与 {filename} 一致")
+        else:
+            raise SystemExit(f"{output} 与 {filename} 不一致，请重新转换")
+        return
+
+    if is_archive(filename):
+        raise SystemExit(f"{filename} 已经是归档文件")
+    trace, _ = read_trace_auto(filename, use_cache=False)
+    header = write_archive(output, trace, dtau=args.dtau, source=filename)
+    print(f"写入 {output}")
+    print_header(output, header)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert trace files to archives")
+    add_arguments(parser)
+    main(parser.parse_args())
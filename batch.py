@@ -0,0 +1,111 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lib.analysis import ANALYSES, INPUT_DTAU, analyze_file
+from lib.equilibration import parse_start
+from lib.write_file import save_table
+
+"""
+批量分析多个 trace 文件，文件分给多个进程并行计算，结果写成一个表
+文件可以用通配符给出，也可以用 --manifest 给一个每行一个路径的清单
+一个文件出错只记在它的 status 列中，不影响其他文件
+"""
+
+
+# 展开通配符与清单，去重并保持顺序
+def collect_files(patterns, manifest=None):
+    files = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern))
+        files.extend(matched if matched else [pattern])
+    if manifest is not None:
+        with open(manifest, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    files.append(line)
+    return list(dict.fromkeys(files))
+
+
+def add_arguments(parser):
+    parser.add_argument("files", nargs="*", help="Trace files or glob patterns")
+    parser.add_argument("--manifest", default=None, help="File listing trace paths")
+    parser.add_argument(
+        "--analyses",
+        default=",".join(ANALYSES),
+        help=f"Comma-separated analyses from {', '.join(ANALYSES)}",
+    )
+    parser.add_argument(
+        "--states",
+        default=None,
+        help="Comma-separated state indices, default all states",
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_start,
+        default=0.3,
+        help='Drop ratio of the burn-in, or "auto" to detect equilibration',
+    )
+    parser.add_argument(
+        "--dtau", type=float, default=INPUT_DTAU, help="dtau of the FCIQMC input"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Number of processes"
+    )
+    parser.add_argument("--output", default="batch_result.csv", help="Output table")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use the binary trace cache"
+    )
+
+
+def main(args):
+    files = collect_files(args.files, args.manifest)
+    if not files:
+        raise SystemExit("没有需要分析的文件。")
+
+    analyses = [a.strip() for a in args.analyses.split(",") if a.strip()]
+    for a in analyses:
+        if a not in ANALYSES:
+            raise ValueError(f"未知的分析: {a}，可选 {', '.join(ANALYSES)}")
+    states = None
+    if args.states is not None:
+        states = [int(x) for x in args.states.split(",")]
+
+    print(f"分析 {len(files)} 个文件，{args.workers} 个进程...")
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(
+                analyze_file,
+                filename,
+                analyses=analyses,
+                states=states,
+                drop_ratio=args.start,
+                input_dtau=args.dtau,
+                use_cache=not args.no_cache,
+                quiet=True,
+            ): filename
+            for filename in files
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                results[filename] = future.result()
+            except Exception as e:
+                # 子进程本身崩溃（例如内存不足）
+                results[filename] = [{"file": filename, "status": f"worker: {e}"}]
+            status = [row["status"] for row in results[filename]]
+            print(f"{filename}: {'; '.join(status)}")
+
+    # 按输入顺序输出
+    rows = [row for filename in files for row in results[filename]]
+    save_table(args.output, rows)
+    print(f"结果写入 {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch trace analysis tool")
+    add_arguments(parser)
+    main(parser.parse_args())
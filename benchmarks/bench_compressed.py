@@ -0,0 +1,76 @@
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from make_trace import make_trace
+from lib.read_file import read_normal_trace_file
+
+"""
+压缩 trace 的读取速度：同一个 trace 分别用 gzip、xz、bz2 压缩后读取，与不压缩的对比
+MB/s 按解压后的大小计算，peak 是 tracemalloc 记录的峰值内存
+"""
+
+COMPRESSORS = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}
+
+
+# 取多次中最快的一次，另外单独跑一次用 tracemalloc 记录峰值内存
+def bench(label, func, filename, repeat):
+    size_mb = os.path.getsize(filename) / 2**20
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(filename)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    func(filename)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    print(
+        f"{label:>10}: {best:8.3f} s  {size_mb / best:8.1f} MB/s  peak {peak:8.1f} MB"
+    )
+    return best
+
+
+# 压缩 filename，返回压缩后的文件名
+def compress(filename, suffix):
+    target = filename + suffix
+    with open(filename, "rb") as src, COMPRESSORS[suffix](target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 22)
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed trace benchmark")
+    parser.add_argument("file", nargs="?", default=None, help="Trace file to read")
+    parser.add_argument("--nsteps", type=int, default=1_000_000)
+    parser.add_argument("--ns", type=int, default=1, help="Number of states")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "trace.txt")
+        if args.file is None:
+            make_trace(filename, args.nsteps, args.ns)
+        else:
+            shutil.copy(args.file, filename)
+        size_mb = os.path.getsize(filename) / 2**20
+        print(f"{filename}: {size_mb:.1f} MB")
+
+        t_plain = bench("plain", read_normal_trace_file, filename, args.repeat)
+        for suffix in COMPRESSORS:
+            target = compress(filename, suffix)
+            ratio = os.path.getsize(filename) / os.path.getsize(target)
+            # bench 按文件大小算 MB/s，这里换算成解压后的大小
+            t = bench(suffix.lstrip("."), read_normal_trace_file, target, args.repeat)
+            print(
+                f"{'':>10}  {size_mb / t:8.1f} MB/s uncompressed, "
+                f"ratio {ratio:.1f}, {t / t_plain:.2f}x plain time"
+            )
@@ -0,0 +1,72 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from make_trace import make_trace
+
+"""
+命令行启动时间测试：不画图的模式不应再导入 matplotlib
+每条命令跑若干次取最快的一次，并检查进程结束时是否导入过 matplotlib
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 运行脚本并在结束时报告 matplotlib 是否被导入
+RUNNER = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    sys.stderr.write("matplotlib imported: %s\\n" % ("matplotlib" in sys.modules))
+"""
+
+
+def bench(label, argv, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(argv, cwd=ROOT, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:>44}: {best * 1000:8.1f} ms")
+    return best
+
+
+def imports_matplotlib(script_argv):
+    proc = subprocess.run(
+        [sys.executable, "-c", RUNNER] + script_argv,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return "matplotlib imported: True" in proc.stderr
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        trace_file = os.path.join(tmp, "trace.txt")
+        make_trace(trace_file, 1000)
+        py = sys.executable
+
+        bench("python -c 'import numpy'", [py, "-c", "import numpy"], args.repeat)
+        bench(
+            "python -c 'import matplotlib.pyplot'",
+            [py, "-c", "import matplotlib.pyplot"],
+            args.repeat,
+        )
+        for script_argv in (
+            ["trace.py", trace_file, "ee", "--no-cache"],
+            ["qmc_analyze.py", "trace", trace_file, "ee", "--no-cache"],
+            ["qmc_analyze.py", "reweight", trace_file, "Egr", "--no-cache"],
+        ):
+            label = " ".join("TRACE" if a == trace_file else a for a in script_argv)
+            bench(label, [py] + script_argv, args.repeat)
+            print(f"{'':>44}  matplotlib imported: {imports_matplotlib(script_argv)}")
@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.block import BlockingAccumulator, fast_block_analysis
+
+"""
+检查 BlockingAccumulator.merge：
+    按对齐的分段（每段之前的样本数是该段最高层块大小的倍数）分别累加再合并，
+    块分析曲线必须与 fast_block_analysis 一次计算完全相同；
+    不对齐的分段，self.n 是 2^i 倍数的各层仍然精确，只有更高的层与一次计算不同
+长度取 2 的幂，此时从开头对齐与从结尾对齐的块相同
+"""
+
+
+# 每段单独累加后依次合并
+def merged(x, sizes, ncols=1):
+    result = BlockingAccumulator(ncols)
+    for part in np.split(x, np.cumsum(sizes)[:-1]):
+        acc = BlockingAccumulator(ncols)
+        acc.add(part)
+        result.merge(acc)
+    return result
+
+
+# 合并后的第 0 ~ v 层应当精确，v 是各次合并中能对齐的最高层的最小值
+def exact_levels(sizes):
+    n = 0
+    v = None
+    for size in sizes:
+        if n > 0:
+            top = size.bit_length() - 1
+            k = 0
+            while k < top and n % (2 << k) == 0:
+                k += 1
+            v = k if v is None else min(v, k)
+        n += size
+    return v
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check BlockingAccumulator.merge")
+    parser.add_argument("--power", type=int, default=14, help="Length is 2^power")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n = 1 << args.power
+    # 有自相关的序列，高层的误差明显大于第 0 层
+    x = np.cumsum(rng.standard_normal(n)) * 0.05 + rng.standard_normal(n)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reference = np.asarray(fast_block_analysis(x)[0])
+
+    aligned = [[n], [n // 2] * 2, [n // 4] * 4, [n // 4, n // 4, n // 2], [n // 8] * 8]
+    for sizes in aligned:
+        errs = np.asarray(merged(x, sizes).block_errors(0)[0])
+        assert errs.shape == reference.shape, (sizes, errs.shape)
+        assert np.allclose(errs, reference, rtol=1e-12, atol=0), sizes
+        print(f"aligned {sizes}: exact, {errs.size} levels")
+
+    unaligned = [[n // 4, 3 * n // 4], [n // 8, 3 * n // 8, n // 2], [300, n - 300]]
+    for sizes in unaligned:
+        errs = np.asarray(merged(x, sizes).block_errors(0)[0])
+        v = exact_levels(sizes)
+        assert np.allclose(errs[: v + 1], reference[: v + 1], rtol=1e-12, atol=0)
+        dev = errs[v + 1 :] / reference[v + 1 : errs.size] - 1
+        print(
+            f"unaligned {sizes}: levels 0-{v} exact, "
+            f"higher levels {np.round(dev, 3).tolist()}"
+        )
@@ -0,0 +1,26 @@
+import numpy as np
+
+"""
+生成测试用的随机 trace 文件
+"""
+
+
+# 生成随机的 normal trace 文件，格式与 FCIQMC 输出一致
+def make_trace(filename, nsteps, ns=1, interval=10, seed=0):
+    rng = np.random.default_rng(seed)
+    n = nsteps * ns
+    step = np.repeat(np.arange(1, nsteps + 1) * interval, ns)
+    sidx = np.tile(np.arange(ns), nsteps)
+    Nw = 1e5 * (1 + 0.01 * rng.standard_normal(n))
+    S = -20 + 0.1 * rng.standard_normal(n)
+    E = (-20 + rng.standard_normal(n)) * 1000
+    J2 = (0.5 + 0.1 * rng.standard_normal(n)) * 1000
+    norm = 1000 + rng.standard_normal(n)
+    with open(filename, "w") as f:
+        f.write("# i, sidx, Nw, S, E, J2, norm\n")
+        np.savetxt(
+            f,
+            np.column_stack([step, sidx, Nw, S, E, J2, norm]),
+            fmt=["%d", "%d", "%.6f", "%.8f", "%.8f", "%.8f", "%.8f"],
+            delimiter=", ",
+        )
@@ -0,0 +1,282 @@
+"""
+对一个 trace 文件计算多种估计量，供批量分析使用
+每种分析单独捕获异常，一种失败不影响其他分析与其他文件
+"""
+
+import contextlib
+import io
+
+import numpy as np
+
+from .block import (
+    multi_block_analysis,
+    plateau_error,
+    scan_block_analysis,
+    scan_block_analysis_energy,
+)
+from .cal import cal_mean, cal_mean_scan, drop_counts, state_data
+from .equilibration import equilibration_ratio, with_equilibration
+from .estimator import cal_growth_estimator
+from .read_file import read_trace_auto
+from .reweight_tools import (
+    cal_reweight_energy,
+    cal_reweight_factor,
+    cal_reweight_S,
+    compute_dtau,
+)
+from .trace_data import Trace
+
+ANALYSES = ("es", "ee", "ej2", "Egr", "reweight", "blocking")
+# replica trace 只有 E、J2 与 norm
+REPLICA_ANALYSES = ("ee", "ej2", "blocking")
+# 每种分析用到的观测量，读取 trace 时只解析这些列
+ANALYSIS_OBSERVABLES = {
+    "es": ("S",),
+    "ee": ("E", "norm"),
+    "ej2": ("J2", "norm"),
+    "Egr": ("S", "Nw"),
+    "reweight": ("S", "E", "norm", "Nw"),
+    "blocking": ("E", "norm", "J2", "S"),
+}
+
+# 与 reweight.py 中相同的默认参数
+INPUT_DTAU = 0.0001  # FCIQMC 输入的 dtau
+REWEIGHT_ORDER_E = 1000
+REWEIGHT_ORDER_S = 5000
+
+
+# 某种 trace 能做的分析
+def applicable_analyses(trace_type):
+    return REPLICA_ANALYSES if trace_type == "replica" else ANALYSES
+
+
+# 一组分析需要读取的观测量，drop_ratio 为 "auto" 时加上检测平衡点用到的
+def required_observables(analyses, drop_ratio=0.3):
+    names = [n for a in analyses for n in ANALYSIS_OBSERVABLES.get(a, ())]
+    return with_equilibration(tuple(dict.fromkeys(names)), drop_ratio)
+
+
+# 从所有态一起算出的结果中取第 i 个态
+def _pick_state(result, i):
+    row = {}
+    for name, value in result.items():
+        if name in ("E_block", "J2_block", "S_block"):
+            row[name] = [level[i] for level in value]
+        elif isinstance(value, np.ndarray):
+            row[name] = value[i]
+        else:
+            row[name] = value
+    return row
+
+
+# 对一个态做 analyses 中的分析，返回 {量的名字: 值}，失败的分析记在 "status" 中
+# curves 为 True 时同时返回完整的块分析曲线（E_block、J2_block、S_block）
+# state 为 None 时同时分析所有态，每个量是 (NS,) 数组
+def analyze_state(trace, trace_type, analyses, state, drop_ratio, dtau, curves=False):
+    result = {}
+    failed = []
+    is_replica = trace_type == "replica"
+
+    for name in analyses:
+        try:
+            if name == "es":
+                if is_replica:
+                    raise ValueError("replica trace 文件中没有 S 数据")
+                result["S"] = cal_mean(state_data(trace["S"], state), drop_ratio)
+
+            elif name == "ee":
+                ee = cal_mean(state_data(trace["E"], state), drop_ratio)
+                enorm = cal_mean(state_data(trace["norm"], state), drop_ratio)
+                result["E"] = ee / enorm
+
+            elif name == "ej2":
+                ej2 = cal_mean(state_data(trace["J2"], state), drop_ratio)
+                enorm = cal_mean(state_data(trace["norm"], state), drop_ratio)
+                result["J2"] = ej2 / enorm
+
+            elif name == "Egr":
+                if is_replica:
+                    raise ValueError("replica trace 文件中没有 Nw 数据")
+                result["Egr"] = cal_growth_estimator(
+                    trace, dtau, drop_ratio=drop_ratio, state=state
+                )
+
+            elif name == "reweight":
+                if is_replica:
+                    raise ValueError("replica trace 文件中没有 S 数据，无法重加权")
+                start_idx, W = cal_reweight_factor(
+                    trace, dtau, REWEIGHT_ORDER_E, drop_ratio=drop_ratio, state=state
+                )
+                result["E_rw"] = cal_reweight_energy(
+                    state_data(trace["E"], state),
+                    state_data(trace["norm"], state),
+                    start_idx,
+                    W,
+                )
+                result["S_rw"] = cal_reweight_S(
+                    trace, dtau, REWEIGHT_ORDER_S, drop_ratio=drop_ratio, state=state
+                )
+
+            elif name == "blocking":
+                # 所有观测量一起分块，一次得到 E/norm、J2/norm 与 S 的误差
+                columns = {
+                    k: state_data(trace[k], state)
+                    for k in ("E", "norm", "J2", "S")
+                    if k in trace
+                }
+                n = columns["E"].shape[-1]
+                drop_n = int(n * drop_ratio)
+                blocking = multi_block_analysis(
+                    {k: v[..., drop_n:] for k, v in columns.items()},
+                    ratios=[("E", "norm"), ("J2", "norm")],
+                )
+                outputs = [("E", "E/norm"), ("J2", "J2/norm")]
+                if not is_replica:
+                    outputs.append(("S", "S"))
+                for key, curve in outputs:
+                    std_errs, _ = blocking[curve]
+                    result[f"{key}_err"] = plateau_error(std_errs, n - drop_n)
+                    if curves:
+                        result[f"{key}_block"] = std_errs
+
+            else:
+                raise ValueError(f"未知的分析: {name}")
+
+        except Exception as e:
+            failed.append(f"{name}: {e}")
+
+    result["status"] = "; ".join(failed) if failed else "ok"
+    return result
+
+
+# 对已经读入的 trace 的所有（或指定的）态做分析，返回每个态一个 dict 的列表
+# analyses 为 None 时做这种 trace 能做的所有分析
+# 各个态长度相同时所有态一起向量化计算，否则逐个态计算
+# drop_ratio 为 "auto" 时逐个态自动检测平衡点，实际的丢弃比例记在 "drop_ratio" 中
+def analyze_trace(
+    trace,
+    trace_type,
+    analyses=None,
+    states=None,
+    drop_ratio=0.3,
+    input_dtau=INPUT_DTAU,
+    curves=False,
+):
+    if analyses is None:
+        analyses = applicable_analyses(trace_type)
+    dtau = compute_dtau(input_dtau)
+    if states is None:
+        states = range(Trace.from_mapping(trace).nstates)
+    states = list(states)
+
+    selected = None
+    if drop_ratio != "auto":
+        try:
+            selected = {}
+            for name, value in trace.items():
+                if name != "steps":
+                    value = state_data(value, None)
+                    if states != list(range(len(value))):
+                        value = value[states]
+                selected[name] = value
+        except (ValueError, IndexError):
+            selected = None
+
+    if selected is not None:
+        result = analyze_state(
+            selected, trace_type, analyses, None, drop_ratio, dtau, curves=curves
+        )
+        return [
+            {"state": state, "type": trace_type, **_pick_state(result, i)}
+            for i, state in enumerate(states)
+        ]
+
+    rows = []
+    for state in states:
+        row = {"state": state, "type": trace_type}
+        ratio = drop_ratio
+        if drop_ratio == "auto":
+            try:
+                ratio = equilibration_ratio(trace, state=state)
+            except Exception as e:
+                row["status"] = f"equilibration: {e}"
+                rows.append(row)
+                continue
+            row["drop_ratio"] = ratio
+        row.update(
+            analyze_state(
+                trace, trace_type, analyses, state, ratio, dtau, curves=curves
+            )
+        )
+        rows.append(row)
+    return rows
+
+
+# 读取一个 trace 文件并对所有（或指定的）态做分析，返回每个态一行的列表
+# 读取失败时返回一行错误信息，不抛出异常；quiet 为 True 时屏蔽各计算函数的打印
+def analyze_file(
+    filename,
+    analyses=ANALYSES,
+    states=None,
+    drop_ratio=0.3,
+    input_dtau=INPUT_DTAU,
+    use_cache=True,
+    quiet=False,
+):
+    if quiet:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return analyze_file(
+                filename, analyses, states, drop_ratio, input_dtau, use_cache
+            )
+
+    try:
+        trace, trace_type = read_trace_auto(
+            filename,
+            use_cache=use_cache,
+            observables=required_observables(analyses, drop_ratio),
+        )
+    except Exception as e:
+        return [{"file": filename, "status": f"read: {e}"}]
+
+    rows = analyze_trace(
+        trace,
+        trace_type,
+        analyses=analyses,
+        states=states,
+        drop_ratio=drop_ratio,
+        input_dtau=input_dtau,
+    )
+    return [{"file": filename, **row} for row in rows]
+
+
+# 一次计算一组丢弃比例下的 <S>、<E>/<norm>、<J2>/<norm> 与块分析误差
+# 均值用后缀和，块分析每层只算一次，扫描几十个丢弃点的开销与一次分析相当
+# state 为 None 时同时计算所有态，每个量是 (NS, len(drop_ratios)) 数组
+def scan_drop_ratios(trace, drop_ratios, state=0, ddof=1):
+    """
+    返回 dict：drop_ratio、drop_n 以及 S、S_err（replica trace 没有）、E、E_err、J2、J2_err，
+    每个量沿最后一个轴对应 drop_ratios 中的一个丢弃比例
+    """
+    E_arr = state_data(trace["E"], state)
+    norm_arr = state_data(trace["norm"], state)
+    J2_arr = state_data(trace["J2"], state)
+    n = E_arr.shape[-1]
+    drop_ratios = np.atleast_1d(np.asarray(drop_ratios, dtype=float))
+    drop_ns = drop_counts(n, drop_ratios)
+    data_nums = n - drop_ns
+
+    result = {"drop_ratio": drop_ratios, "drop_n": drop_ns}
+    if "S" in trace:
+        S_arr = state_data(trace["S"], state)
+        result["S"] = cal_mean_scan(S_arr, drop_ratios)
+        std_errs, _ = scan_block_analysis(S_arr, drop_ns, ddof)
+        result["S_err"] = plateau_error(std_errs, data_nums)
+
+    norm_mean = cal_mean_scan(norm_arr, drop_ratios)
+    result["E"] = cal_mean_scan(E_arr, drop_ratios) / norm_mean
+    std_errs, _ = scan_block_analysis_energy(E_arr, norm_arr, drop_ns, ddof)
+    result["E_err"] = plateau_error(std_errs, data_nums)
+    result["J2"] = cal_mean_scan(J2_arr, drop_ratios) / norm_mean
+    std_errs, _ = scan_block_analysis_energy(J2_arr, norm_arr, drop_ns, ddof)
+    result["J2_err"] = plateau_error(std_errs, data_nums)
+    return result
@@ -0,0 +1,165 @@
+"""
+trace 的列式归档格式
+
+跑完的 trace 可以转换成一个二进制归档文件，之后直接内存映射读取，不再解析文本。
+文件布局：
+    MAGIC (8 字节) | header 长度 (uint64，小端) | JSON header | 补齐 | 各列数据
+header 记录 step 网格、间隔、trace 类型、dtau、原 trace 文件的 sha256，以及每一列的
+偏移、dtype 与每个态的长度。每个观测量的数据按态依次连续存放，每个态内按 step 连续，
+各列的起点按 ALIGNMENT 字节对齐。
+读取时每一列是 np.memmap，分析只会读到实际用到的列与窗口对应的页。
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .trace_data import Trace
+
+MAGIC = b"QMCTRACE"
+ARCHIVE_VERSION = 1
+ALIGNMENT = 64
+ARCHIVE_SUFFIX = ".qtr"
+# 计算 sha256 时每次读取的字节数
+HASH_CHUNK = 1 << 22
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# 文件开头是否是归档的 MAGIC
+def is_archive(filename):
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+# 分块计算文件的 sha256，内存与文件大小无关
+def file_sha256(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# 把 Trace 写成归档文件
+def write_archive(filename, trace, dtau=None, source=None):
+    """
+    dtau: FCIQMC 输入的 dtau，记录在 header 中
+    source: 原 trace 文件，记录它的路径、大小与 sha256
+    """
+    columns = {}
+    arrays = []
+    offset = 0
+    for name in trace.observables:
+        states = [np.ascontiguousarray(v, dtype=np.float64) for v in trace[name]]
+        columns[name] = {
+            "offset": offset,
+            "dtype": "<f8",
+            "lengths": [int(v.size) for v in states],
+        }
+        arrays.append((offset, states))
+        offset = _aligned(offset + sum(v.nbytes for v in states))
+    steps = np.ascontiguousarray(trace.steps, dtype="<i8")
+    columns["steps"] = {"offset": offset, "dtype": "<i8", "lengths": [steps.size]}
+    arrays.append((offset, [steps]))
+
+    header = {
+        "version": ARCHIVE_VERSION,
+        "trace_type": trace.trace_type,
+        "nstates": trace.nstates,
+        "nsteps": trace.nsteps,
+        "first_step": int(steps[0]) if steps.size else None,
+        "interval": trace.interval,
+        "dtau": dtau,
+        "columns": columns,
+    }
+    if source is not None:
+        header["source"] = {
+            "path": os.path.abspath(source),
+            "size": os.path.getsize(source),
+            "sha256": file_sha256(source),
+        }
+    text = json.dumps(header, indent=2).encode()
+    # 列的偏移从数据区开头算起，数据区从对齐的位置开始
+    data_start = _aligned(len(MAGIC) + 8 + len(text))
+
+    # 先写到临时文件再改名，写入中途失败时不会留下不完整的归档
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(text)).astype("<u8").tobytes())
+        f.write(text)
+        for offset, states in arrays:
+            f.seek(data_start + offset)
+            for v in states:
+                v.tofile(f)
+    os.replace(tmp, filename)
+    return header
+
+
+# 读取归档的 header，数据区的起点记在 header["data_start"] 中
+def read_archive_header(filename):
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} 不是 trace 归档文件")
+        length = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(length))
+    if header.get("version") != ARCHIVE_VERSION:
+        raise ValueError(
+            f"不支持的归档版本 {header.get('version')}，当前版本为 {ARCHIVE_VERSION}"
+        )
+    header["data_start"] = _aligned(len(MAGIC) + 8 + length)
+    return header
+
+
+# 内存映射一列，各个态长度相同时返回 (NS, nsteps) 数组，否则返回每个态一个数组的列表
+def _map_column(filename, column, data_start):
+    lengths = column["lengths"]
+    total = sum(lengths)
+    if total == 0:
+        return np.empty((len(lengths), 0), dtype=column["dtype"])
+    arr = np.memmap(
+        filename,
+        dtype=column["dtype"],
+        mode="r",
+        offset=data_start + column["offset"],
+        shape=(total,),
+    )
+    if len(set(lengths)) == 1:
+        return arr.reshape(len(lengths), lengths[0])
+    return np.split(arr, np.cumsum(lengths)[:-1])
+
+
+# 打开归档文件，返回 (trace, trace_type)，与 read_trace_auto 相同
+def read_archive(filename, observables=None):
+    """
+    observables: 只映射这些观测量，None 表示全部，归档中没有的观测量跳过
+    每个观测量是只读的 np.memmap，trace.window() 与 trace.state() 返回它的视图
+    """
+    header = read_archive_header(filename)
+    columns = header["columns"]
+    names = [name for name in columns if name != "steps"]
+    if observables is not None:
+        names = [name for name in names if name in observables]
+
+    start = header["data_start"]
+    steps = _map_column(filename, columns["steps"], start)[0]
+    data = {name: _map_column(filename, columns[name], start) for name in names}
+    return Trace(steps, data, header["trace_type"]), header["trace_type"]
+
+
+# 检查归档是否对应 source 这个 trace 文件，大小与 sha256 都相同时返回 True
+def archive_matches(filename, source):
+    recorded = read_archive_header(filename).get("source")
+    if recorded is None:
+        return False
+    if recorded["size"] != os.path.getsize(source):
+        return False
+    return recorded["sha256"] == file_sha256(source)
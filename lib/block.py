@@ -4,6 +4,8 @@
 
 import numpy as np
 
+from .cal import suffix_sums
+
 
 # X/Y 标准差合成
 def std_err_ratio(X_mean, Y_mean, X_std_err, Y_std_err, cov_XY, data_num):
@@ -144,3 +146,404 @@ def block_analysis_energy(E_array, norm_array, ddof=1):
         i += 1  # 增加块大小指数
 
     return std_errs, std_err_errs
+
+
+# 块平均的一层：数据数为奇数时丢掉开头一个，剩下的两两求平均
+# 沿最后一个轴操作，前面的轴可以是不同的观测量或不同的态
+def _halve(blocks):
+    n = blocks.shape[-1]
+    blocks = blocks[..., n % 2 :]
+    return blocks.reshape(*blocks.shape[:-1], -1, 2).mean(axis=-1)
+
+
+# 逐层生成块平均数据，第 i 层块大小为 2^i
+# 每一层都由上一层两两平均得到，总计算量 O(N)
+# 与 block_analysis 一样跳过开头不完整的数据，因此每一层的块与原来的逐块计算完全一致
+def _block_levels(data, ddof=1):
+    blocks = np.asarray(data, dtype=float)
+    i = 0
+    while blocks.shape[-1] > ddof:
+        yield i, blocks
+        blocks = _halve(blocks)
+        i += 1
+
+
+# 单个 array 的块分析，逐层两两平均的快速版本，结果与 block_analysis 相同
+# 输入 (NS, N) 时同时分析所有态，每一层的结果是 (NS,) 数组
+def fast_block_analysis(array, ddof=1):
+    std_errs = []
+    std_err_errs = []
+    print("Starting fast block analysis...")
+    for i, blocks in _block_levels(array, ddof):
+        num_blocks = blocks.shape[-1]
+        std_err = np.std(blocks, ddof=ddof, axis=-1) / np.sqrt(num_blocks)
+        std_err_err = std_err / np.sqrt(2 * (num_blocks - ddof))
+        std_errs.append(std_err)
+        std_err_errs.append(std_err_err)
+
+    print(f"Block analysis done, {len(std_errs)} levels.")
+    return std_errs, std_err_errs
+
+
+# 块分析能量的快速版本，需要输入未归一化的能量与归一化因子，结果与 block_analysis_energy 相同
+# 输入 (NS, N) 时同时分析所有态，每一层的结果是 (NS,) 数组
+def fast_block_analysis_energy(E_array, norm_array, ddof=1):
+    # 检查
+    if np.shape(E_array) != np.shape(norm_array):
+        print("Error: E_array and norm_array must have the same length.")
+        return None, None
+
+    std_errs = []
+    std_err_errs = []
+    print("Starting fast block analysis for energy...")
+    # E 与 norm 叠成 (2, ..., N) 一起分块
+    data = np.stack([np.asarray(E_array), np.asarray(norm_array)])
+    for i, blocks in _block_levels(data, ddof):
+        Emean_block, normmean_block = blocks
+        num_blocks = blocks.shape[-1]
+
+        Emean = np.mean(Emean_block, axis=-1)
+        normmean = np.mean(normmean_block, axis=-1)
+        E_std_str = np.std(Emean_block, ddof=ddof, axis=-1) / np.sqrt(num_blocks)
+        norm_std_str = np.std(normmean_block, ddof=ddof, axis=-1) / np.sqrt(num_blocks)
+        cov_EN = np.sum(
+            (Emean_block - Emean[..., None]) * (normmean_block - normmean[..., None]),
+            axis=-1,
+        ) / (num_blocks - ddof)
+        std_err = std_err_ratio(
+            Emean,
+            normmean,
+            E_std_str,
+            norm_std_str,
+            cov_EN,
+            num_blocks,
+        )
+        std_err_err = std_err / np.sqrt(2 * (num_blocks - ddof))
+        std_errs.append(std_err)
+        std_err_errs.append(std_err_err)
+
+    print(f"Block analysis done, {len(std_errs)} levels.")
+    return std_errs, std_err_errs
+
+
+# 多个观测量一起块分析，每一层给出各观测量均值估计的完整协方差矩阵
+def block_covariance(data, ddof=1):
+    """
+    data: (ncols, N) 或 (ncols, NS, N)，第一个轴是不同的观测量
+    返回 (means, covs, nums)，每一层一个：
+        means: (ncols,) 或 (NS, ncols) 的块均值
+        covs: (ncols, ncols) 或 (NS, ncols, ncols)，均值估计的协方差，即块均值的协方差除以块数
+        nums: 块数
+    """
+    means = []
+    covs = []
+    nums = []
+    for i, blocks in _block_levels(data, ddof):
+        num_blocks = blocks.shape[-1]
+        mean = np.moveaxis(blocks.mean(axis=-1), 0, -1)
+        d = np.moveaxis(blocks, 0, -2) - mean[..., None]
+        cov = d @ np.swapaxes(d, -1, -2) / ((num_blocks - ddof) * num_blocks)
+        means.append(mean)
+        covs.append(cov)
+        nums.append(num_blocks)
+    return means, covs, nums
+
+
+# delta 方法：导数为 grad 的函数 f(均值) 的误差 sqrt(grad^T C grad)，std_err_ratio 的推广
+def delta_method_error(grad, cov):
+    grad = np.asarray(grad, dtype=float)
+    q = np.einsum("...i,...ij,...j->...", grad, cov, grad)
+    # 几乎确定的比值（分子分母强相关）舍入后二次型可能略小于 0
+    return np.sqrt(np.maximum(q, 0.0))
+
+
+# 第 num 个与第 den 个观测量之比 X/Y 的误差，与 std_err_ratio 相同
+def ratio_error(mean, cov, num, den):
+    X = mean[..., num]
+    Y = mean[..., den]
+    grad = np.zeros(mean.shape)
+    grad[..., num] = 1.0 / Y
+    grad[..., den] = -X / Y**2
+    return delta_method_error(grad, cov)
+
+
+# 一次块分析多个观测量，columns 是 {名字: 数据}，ratios 是 (分子, 分母) 的名字对
+# 返回 {名字或 "分子/分母": (std_errs, std_err_errs)}，
+# 与分别调用 fast_block_analysis、fast_block_analysis_energy 的结果相同
+def multi_block_analysis(columns, ratios=(), ddof=1):
+    names = list(columns)
+    index = {name: i for i, name in enumerate(names)}
+    print("Starting block analysis for " + ", ".join(names) + "...")
+    data = np.stack([np.asarray(columns[name], dtype=float) for name in names])
+    means, covs, nums = block_covariance(data, ddof)
+
+    curves = {}
+    for name in names:
+        i = index[name]
+        curves[name] = [np.sqrt(cov[..., i, i]) for cov in covs]
+    for num, den in ratios:
+        curves[f"{num}/{den}"] = [
+            ratio_error(mean, cov, index[num], index[den])
+            for mean, cov in zip(means, covs)
+        ]
+
+    result = {}
+    for name, std_errs in curves.items():
+        std_err_errs = [
+            std_err / np.sqrt(2 * (num_blocks - ddof))
+            for std_err, num_blocks in zip(std_errs, nums)
+        ]
+        result[name] = (std_errs, std_err_errs)
+    print(f"Block analysis done, {len(nums)} levels.")
+    return result
+
+
+# 对多个丢弃点同时做块分析的公共部分
+# 块从结尾对齐，丢弃开头 drop_n 个数据后第 i 层的块正好是整段数据第 i 层块的最后 (N - drop_n) >> i 个，
+# 因此每层的块只算一次，各个丢弃点的和与平方和都从同一个后缀和中取
+# 逐层生成 (块数, 有效标记, 各丢弃点的后缀和函数)
+def _scan_levels(data, drop_ns, ddof=1):
+    data = np.asarray(data, dtype=float)
+    # 先减去整体均值，减小平方和相减时的舍入误差，不改变方差与协方差
+    data = data - data.mean(axis=-1, keepdims=True)
+    tail = data.shape[-1] - np.asarray(drop_ns)
+    for i, blocks in _block_levels(data, ddof):
+        nb = tail >> i
+        valid = nb > ddof
+        start = blocks.shape[-1] - np.where(valid, nb, 0)
+
+        def tail_sum(x, start=start):
+            return suffix_sums(x)[..., start]
+
+        yield np.where(valid, nb, ddof + 1), valid, blocks, tail_sum
+
+
+# 多个丢弃点的块分析，drop_ns 是各个丢弃点丢弃的开头数据个数
+# 返回每一层一个 (..., len(drop_ns)) 数组，与对每段数据分别 fast_block_analysis 相同，
+# 块数不够的位置为 NaN
+def scan_block_analysis(array, drop_ns, ddof=1):
+    std_errs = []
+    std_err_errs = []
+    print("Starting block analysis scan...")
+    for nb, valid, blocks, tail_sum in _scan_levels(array, drop_ns, ddof):
+        s1 = tail_sum(blocks)
+        s2 = tail_sum(blocks**2)
+        var = np.maximum(s2 - s1**2 / nb, 0.0) / (nb - ddof)
+        std_err = np.where(valid, np.sqrt(var / nb), np.nan)
+        std_errs.append(std_err)
+        std_err_errs.append(std_err / np.sqrt(2 * (nb - ddof)))
+
+    print(f"Block analysis done, {len(std_errs)} levels.")
+    return std_errs, std_err_errs
+
+
+# 多个丢弃点的能量块分析，与对每段数据分别 fast_block_analysis_energy 相同
+def scan_block_analysis_energy(E_array, norm_array, drop_ns, ddof=1):
+    if np.shape(E_array) != np.shape(norm_array):
+        print("Error: E_array and norm_array must have the same length.")
+        return None, None
+
+    data = np.stack([np.asarray(E_array, dtype=float), np.asarray(norm_array)])
+    ref = data.mean(axis=-1, keepdims=True)
+    std_errs = []
+    std_err_errs = []
+    print("Starting block analysis scan for energy...")
+    for nb, valid, blocks, tail_sum in _scan_levels(data, drop_ns, ddof):
+        E_block, norm_block = blocks
+        sE, sN = tail_sum(blocks)
+        sEE = tail_sum(E_block**2)
+        sNN = tail_sum(norm_block**2)
+        sEN = tail_sum(E_block * norm_block)
+
+        Emean = sE / nb + ref[0]
+        normmean = sN / nb + ref[1]
+        E_var = np.maximum(sEE - sE**2 / nb, 0.0) / (nb - ddof)
+        norm_var = np.maximum(sNN - sN**2 / nb, 0.0) / (nb - ddof)
+        cov_EN = (sEN - sE * sN / nb) / (nb - ddof)
+        std_err = std_err_ratio(
+            Emean,
+            normmean,
+            np.sqrt(E_var / nb),
+            np.sqrt(norm_var / nb),
+            cov_EN,
+            nb,
+        )
+        std_err = np.where(valid, std_err, np.nan)
+        std_errs.append(std_err)
+        std_err_errs.append(std_err / np.sqrt(2 * (nb - ddof)))
+
+    print(f"Block analysis done, {len(std_errs)} levels.")
+    return std_errs, std_err_errs
+
+
+# 流式块分析，样本可以逐个或分批加入，每一层只保存块均值的个数、均值与二阶矩
+# 以及一个等待配对的块，内存 O(log N)
+# 块从数据开头对齐（block_analysis 从结尾对齐），数据量是 2^i 的倍数时两者第 i 层完全相同
+# 两个累加器可以用 merge 合并，用于分段读取的 trace 或独立的几次计算
+class BlockingAccumulator:
+    def __init__(self, ncols=1, ddof=1):
+        """
+        ncols: 同时分块的列数，例如 E 与 norm 一起分块就是 2
+        ddof: 与 block_analysis 相同
+        """
+        self.ncols = ncols
+        self.ddof = ddof
+        self.n = 0  # 加入的样本总数
+        self.counts = []  # 每一层已完成的块数
+        self.means = []  # 每一层块均值的均值，(ncols,)
+        self.M2 = []  # 每一层块均值的离差平方和（含交叉项），(ncols, ncols)
+        self.pending = []  # 每一层等待配对的块均值，没有时为 None
+
+    # 加入一个或一批样本，samples 形状为 (ncols,)、(m,) 或 (m, ncols)
+    def add(self, samples):
+        x = np.asarray(samples, dtype=float).reshape(-1, self.ncols)
+        self.n += x.shape[0]
+        self._push(0, x)
+
+    # 把第 level 层的一批新块加入统计量，并逐层向上两两平均
+    def _push(self, level, x):
+        while x.shape[0] > 0:
+            self._ensure_level(level)
+            self._update_level(level, x)
+
+            # 和上次剩下的块一起两两平均，得到上一层的新块
+            if self.pending[level] is not None:
+                x = np.vstack([self.pending[level], x])
+            if x.shape[0] % 2:
+                self.pending[level] = x[-1].copy()
+                x = x[:-1]
+            else:
+                self.pending[level] = None
+            x = 0.5 * (x[0::2] + x[1::2])
+            level += 1
+
+    def _ensure_level(self, level):
+        while len(self.counts) <= level:
+            self.counts.append(0)
+            self.means.append(np.zeros(self.ncols))
+            self.M2.append(np.zeros((self.ncols, self.ncols)))
+            self.pending.append(None)
+
+    # 把另一个累加器合并进来，other 看作接在 self 后面的数据，逐层决定能否对齐
+    # self 的样本数是 2^i 的倍数时，第 i 层两段的块与连续加入完全相同，统计量直接合并；
+    # 设 v 是满足这个条件的最高层（不超过 other 的最高层 top），第 0 ~ v 层都是精确的。
+    # v = top 时 self 在第 top 层等待配对的块与 other 唯一的块相邻，两两平均后继续向上，
+    # 结果与连续加入完全相同。
+    # v < top 时第 v 层以上 other 的块相对连续加入错开了 self.n mod 2^i 个样本，
+    # 只保存了统计量，无法重新配对，这些层退回为直接合并错开的块，
+    # self 在这些层等待配对的块丢弃，每层最多少一个块
+    def merge(self, other):
+        if other.ncols != self.ncols or other.ddof != self.ddof:
+            raise ValueError("合并的两个累加器 ncols 与 ddof 必须相同。")
+        if other.n == 0:
+            return self
+
+        top = len(other.counts) - 1
+        v = 0
+        while v < top and self.n % (2 << v) == 0:
+            v += 1
+        self.n += other.n
+        self._ensure_level(top)
+        for level in range(top + 1):
+            self._combine_level(
+                level, other.counts[level], other.means[level], other.M2[level]
+            )
+
+        # 第 v 层以下 self 的块数都是偶数，没有等待配对的块，接上 other 的
+        self.pending[:v] = other.pending[:v]
+        if v == top:
+            # other 的最高层只有一个块，就是它等待配对的块
+            if self.pending[top] is not None:
+                pair = 0.5 * (self.pending[top] + other.pending[top])
+                self.pending[top] = None
+                self._push(top + 1, pair.reshape(1, -1))
+            else:
+                self.pending[top] = other.pending[top]
+        else:
+            # self 在第 v 层等待配对的块应该与 other 的第一个块配对，后者没有保存；
+            # 第 v 层以上退回为 other 的错开的块
+            self.pending[v] = None
+            self.pending[v + 1 :] = [None] * (len(self.pending) - v - 1)
+            self.pending[v + 1 : top + 1] = other.pending[v + 1 : top + 1]
+        return self
+
+    # 用 Chan 的合并公式把一批新块并入第 level 层的统计量
+    def _update_level(self, level, blocks):
+        nb = blocks.shape[0]
+        mean_b = blocks.mean(axis=0)
+        d = blocks - mean_b
+        self._combine_level(level, nb, mean_b, d.T @ d)
+
+    def _combine_level(self, level, nb, mean_b, M2_b):
+        na = self.counts[level]
+        n = na + nb
+        delta = mean_b - self.means[level]
+        self.means[level] = self.means[level] + delta * (nb / n)
+        self.M2[level] = self.M2[level] + M2_b + np.outer(delta, delta) * (na * nb / n)
+        self.counts[level] = n
+
+    # 所有样本的均值，(ncols,)
+    def mean(self):
+        if not self.counts:
+            return np.full(self.ncols, np.nan)
+        return self.means[0].copy()
+
+    # 逐层返回 (块数, 块均值的均值, 块均值的协方差矩阵)，块数不大于 ddof 时停止
+    def levels(self):
+        for num_blocks, mean, M2 in zip(self.counts, self.means, self.M2):
+            if num_blocks <= self.ddof:
+                break
+            yield num_blocks, mean, M2 / (num_blocks - self.ddof)
+
+    # 第 col 列的块分析，返回值与 block_analysis 相同
+    def block_errors(self, col=0):
+        std_errs = []
+        std_err_errs = []
+        for num_blocks, mean, cov in self.levels():
+            std_err = np.sqrt(cov[col, col] / num_blocks)
+            std_errs.append(std_err)
+            std_err_errs.append(std_err / np.sqrt(2 * (num_blocks - self.ddof)))
+        return std_errs, std_err_errs
+
+    # num 列除以 den 列的块分析（例如 E/norm），返回值与 block_analysis_energy 相同
+    def ratio_block_errors(self, num=0, den=1):
+        std_errs = []
+        std_err_errs = []
+        for num_blocks, mean, cov in self.levels():
+            # 与批量块分析相同，用截断在 0 的 delta method 误差
+            std_err = float(ratio_error(mean, cov / num_blocks, num, den))
+            std_errs.append(std_err)
+            std_err_errs.append(std_err / np.sqrt(2 * (num_blocks - self.ddof)))
+        return std_errs, std_err_errs
+
+
+# 按 Lee, Filippi & Needs (PRB 84, 245117) 的准则选块分析平台处的层
+# 第 i 层块大小 B = 2^i，满足 B^3 > 2 N (sigma_i / sigma_0)^4 的最小 i 即为最优块
+# 没有满足条件的层（数据不够长，没有达到平台）时返回 None
+def optimal_block(std_errs, data_num):
+    if len(std_errs) == 0 or std_errs[0] == 0:
+        return None
+    for i, std_err in enumerate(std_errs):
+        block_size = 1 << i
+        if block_size**3 > 2 * data_num * (std_err / std_errs[0]) ** 4:
+            return i
+    return None
+
+
+# 块分析平台处的误差，没有平台时取最大块的误差
+# 每层的误差可以是数组（多个态、多个丢弃点等），逐个找平台，data_num 可以随之广播
+# 块数不够的层记为 NaN，找平台时跳过
+def plateau_error(std_errs, data_num):
+    curves = np.asarray(std_errs, dtype=float)
+    if curves.shape[0] == 0:
+        return np.nan
+    data_num = np.broadcast_to(data_num, curves.shape[1:])
+    errs = np.full(curves.shape[1:], np.nan)
+    for idx in np.ndindex(errs.shape):
+        curve = curves[(slice(None),) + idx]
+        curve = curve[np.isfinite(curve)]
+        if curve.size == 0:
+            continue
+        i = optimal_block(list(curve), data_num[idx])
+        errs[idx] = curve[-1] if i is None else curve[i]
+    return errs[()]
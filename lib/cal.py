@@ -5,18 +5,29 @@
 import numpy as np
 
 
+# 取 trace 中某个态的数据，state 为 None 时取所有态，返回 (NS, nsteps) 数组
+def state_data(values, state=0):
+    if state is None:
+        arr = np.asarray(values, dtype=float)
+        if arr.ndim != 2:
+            raise ValueError("各个态的数据长度不同，无法同时计算所有态。")
+        return arr
+    return np.asarray(values[state], dtype=float)
+
+
 # 计算单数据的均值，丢弃开头一定百分比的数据。可用于计算 S 与 J2 均值，输入的是对应 state 的列
+# 也可以输入 (NS, nsteps) 的数组，沿最后一个轴同时计算所有态，返回 (NS,)
 def cal_mean(data, drop_ratio):
     """
     丢弃前 drop_ratio 比例的数据，返回剩余部分的平均值。
-    data: 一维数组或可迭代对象
+    data: 一维数组或可迭代对象，或 (NS, nsteps) 数组
     drop_ratio: 0~1 之间的小数，例如 0.2 表示丢弃前 20%
     """
     if not (0.0 <= drop_ratio < 1.0):
         raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
 
     arr = np.asarray(data, dtype=float)
-    n = arr.size
+    n = arr.shape[-1] if arr.ndim > 0 else 0
     if n == 0:
         raise ValueError("data 为空，无法计算平均值。")
 
@@ -24,5 +35,38 @@ def cal_mean(data, drop_ratio):
     if drop_n >= n:
         raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
 
-    tail = arr[drop_n:]
-    return tail.mean()
+    tail = arr[..., drop_n:]
+    return tail.mean(axis=-1)
+
+
+# 每个丢弃比例对应丢弃的点数，检查与 cal_mean 相同
+def drop_counts(n, drop_ratios):
+    ratios = np.asarray(drop_ratios, dtype=float)
+    if np.any((ratios < 0.0) | (ratios >= 1.0)):
+        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+    if n == 0:
+        raise ValueError("data 为空，无法计算平均值。")
+    drop_ns = (n * ratios).astype(int)
+    if np.any(drop_ns >= n):
+        raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
+    return drop_ns
+
+
+# 沿最后一个轴的后缀和，out[..., j] = sum(x[..., j:])，最后多一个 0
+def suffix_sums(x):
+    x = np.asarray(x, dtype=float)
+    out = np.zeros(x.shape[:-1] + (x.shape[-1] + 1,))
+    out[..., :-1] = np.cumsum(x[..., ::-1], axis=-1)[..., ::-1]
+    return out
+
+
+# 一次计算多个丢弃比例下的均值，结果与逐个调用 cal_mean 相同，开销与一次相当
+# 输入 (NS, nsteps) 时返回 (NS, len(drop_ratios))
+def cal_mean_scan(data, drop_ratios):
+    arr = np.asarray(data, dtype=float)
+    n = arr.shape[-1] if arr.ndim > 0 else 0
+    drop_ns = drop_counts(n, drop_ratios)
+    # 先减去整体均值，减小长求和的舍入误差
+    ref = arr.mean(axis=-1, keepdims=True)
+    suffix = suffix_sums(arr - ref)
+    return suffix[..., drop_ns] / (n - drop_ns) + ref
@@ -0,0 +1,41 @@
+"""
+压缩的 trace 与 log 文件
+
+按文件开头的魔数识别 gzip、xz、bz2，用标准库的 gzip、lzma、bz2 边读边解压，
+不写临时文件，读取的内存只与每次读取的块大小有关。
+压缩文件不能随机访问，需要字节位置的地方（log 分段、流式分析的最后一行）按顺序解压过去。
+"""
+
+import bz2
+import gzip
+import lzma
+
+# 压缩格式 -> (魔数, 打开函数)
+COMPRESSIONS = {
+    "gzip": (b"\x1f\x8b", gzip.open),
+    "xz": (b"\xfd7zXZ\x00", lzma.open),
+    "bz2": (b"BZh", bz2.open),
+}
+
+
+# 文件的压缩格式，不是压缩文件时返回 None
+def compression_of(filename):
+    with open(filename, "rb") as f:
+        head = f.read(8)
+    for name, (magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def is_compressed(filename):
+    return compression_of(filename) is not None
+
+
+# 打开 trace 或 log 文件，压缩文件边读边解压，mode 为 "rb" 或 "r"
+def open_trace(filename, mode="rb"):
+    compression = compression_of(filename)
+    if compression is None:
+        return open(filename, mode)
+    opener = COMPRESSIONS[compression][1]
+    return opener(filename, "rt" if mode == "r" else mode)
@@ -0,0 +1,108 @@
+"""
+自动确定平衡点（burn-in 的丢弃位置）
+
+用 MSER（marginal standard error rule）：丢弃前 d 个数据后，剩余数据均值的标准误差估计
+    MSER(d) = sum_{i>=d} (x_i - mean_d)^2 / (n - d)^2
+取 MSER 最小的 d。数据先按 batch 个一组平均（MSER-5），曲线更平滑。
+后缀和一次算出所有 d 的 MSER，总开销 O(N)。S、E/norm、Nw 分别检测，取最晚的平衡点。
+结果转换成 drop_ratio，可以直接传给 cal_mean、块分析与 cal_reweight_factor。
+"""
+
+import numpy as np
+
+from .cal import state_data, suffix_sums
+
+MSER_BATCH = 5
+# 平衡点最多取在数据的这个比例处，MSER 曲线在结尾附近因剩余数据太少而不可靠
+MSER_MAX_RATIO = 0.5
+EQUILIBRATION_OBSERVABLES = ("S", "E", "Nw")
+
+
+# 沿最后一个轴计算 MSER 曲线，返回 (曲线, 每个点对应丢弃的数据个数)
+def mser_curve(data, batch=MSER_BATCH):
+    arr = np.asarray(data, dtype=float)
+    nb = arr.shape[-1] // batch
+    if nb < 2:
+        raise ValueError("数据太少，无法检测平衡点。")
+
+    # 从开头分组平均，结尾不足一组的数据不参与检测
+    y = arr[..., : nb * batch].reshape(*arr.shape[:-1], nb, batch).mean(axis=-1)
+    y = y - y.mean(axis=-1, keepdims=True)
+    s1 = suffix_sums(y)[..., :-1]
+    s2 = suffix_sums(y**2)[..., :-1]
+    k = nb - np.arange(nb)
+    curve = np.maximum(s2 - s1**2 / k, 0.0) / k**2
+    return curve, np.arange(nb) * batch
+
+
+# 单个序列的平衡点，返回丢弃的数据个数，(NS, nsteps) 输入时返回 (NS,)
+def mser(data, batch=MSER_BATCH, max_ratio=MSER_MAX_RATIO):
+    curve, drop_ns = mser_curve(data, batch)
+    last = max(1, int(curve.shape[-1] * max_ratio))
+    return drop_ns[np.argmin(curve[..., :last], axis=-1)]
+
+
+# 检测 trace 中某个态的平衡点，S、E/norm、Nw 中取最晚的一个，返回丢弃的数据个数
+# state 为 None 时同时检测所有态，返回 (NS,)
+def detect_equilibration(
+    trace,
+    state=0,
+    observables=EQUILIBRATION_OBSERVABLES,
+    batch=MSER_BATCH,
+    max_ratio=MSER_MAX_RATIO,
+):
+    drop_n = None
+    for name in observables:
+        if name not in trace:
+            continue
+        data = state_data(trace[name], state)
+        if name == "E":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                data = data / state_data(trace["norm"], state)
+            data = np.nan_to_num(data)
+        d = mser(data, batch, max_ratio)
+        drop_n = d if drop_n is None else np.maximum(drop_n, d)
+    if drop_n is None:
+        raise ValueError("trace 中没有可以用来检测平衡点的数据。")
+    return drop_n
+
+
+# 丢弃个数转换为 drop_ratio，保证 int(n * drop_ratio) == drop_n
+def drop_ratio_from_count(drop_n, n):
+    ratio = drop_n / n
+    while int(n * ratio) < drop_n:
+        ratio = np.nextafter(ratio, 1.0)
+    return float(ratio)
+
+
+# 自动检测的平衡点对应的 drop_ratio，可以直接作为各个函数的 drop_ratio 参数
+def equilibration_ratio(trace, state=0, **kwargs):
+    drop_n = detect_equilibration(trace, state=state, **kwargs)
+    n = len(trace["E"][state])
+    return drop_ratio_from_count(int(drop_n), n)
+
+
+# 读取 trace 时需要的观测量，加上 --start auto 检测平衡点用到的（E/norm 需要 norm）
+# observables 为 None 表示读取全部
+def with_equilibration(observables, start):
+    if observables is None or start != "auto":
+        return observables
+    return tuple(dict.fromkeys((*observables, *EQUILIBRATION_OBSERVABLES, "norm")))
+
+
+# 命令行 --start 的类型：一个 0~1 之间的小数，或 "auto" 表示自动检测
+def parse_start(text):
+    if text == "auto":
+        return text
+    return float(text)
+
+
+# 把 --start 的值换成实际的 drop_ratio，"auto" 时检测 state 的平衡点
+def resolve_drop_ratio(start, trace, state=0):
+    if start != "auto":
+        return start
+    ratio = equilibration_ratio(trace, state=state)
+    print(
+        f"自动检测平衡点: 丢弃前 {int(len(trace['E'][state]) * ratio)} 个数据 ({ratio*100:.1f}%)"
+    )
+    return ratio
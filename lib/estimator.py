@@ -4,31 +4,96 @@
 
 import numpy as np
 
+from .block import fast_block_analysis, plateau_error
+from .cal import state_data
+
 
 # growth estimator，效果类似 norm-projected estimator
+# state 为 None 时同时计算所有态，返回 (NS,)
 def cal_growth_estimator(trace, dtau, drop_ratio, state=0):
     if not (0.0 <= drop_ratio < 1.0):
         raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
 
     steps = np.asarray(trace["steps"], dtype=int)
-    Nw_arr = np.asarray(trace["Nw"][state], dtype=float)
-    S_arr = np.asarray(trace["S"][state], dtype=float)
+    Nw_arr = state_data(trace["Nw"], state)
+    S_arr = state_data(trace["S"], state)
     n = steps.size
     interval = steps[1] - steps[0]
     drop_n = int(n * drop_ratio)
     if drop_n >= n:
         raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
 
-    S_arr = S_arr[drop_n:]
-    Nw_arr = Nw_arr[drop_n:]
-    n = len(S_arr)
-    Egr = np.zeros(n - 1, dtype=float)
-    for i in range(1, n):
-        Egr[i - 1] = (
-            S_arr[i - 1]
-            - (Nw_arr[i] - Nw_arr[i - 1]) / (interval * dtau * Nw_arr[i - 1])
-            if Nw_arr[i - 1] != 0
-            else 0.0
-        )
-    Egr_mean = np.mean(Egr)
+    S_arr = S_arr[..., drop_n:]
+    Nw_arr = Nw_arr[..., drop_n:]
+    # Egr_i = S_{i-1} - (N_i - N_{i-1}) / (A dtau N_{i-1})，N_{i-1} 为 0 时记为 0
+    Nw_prev = Nw_arr[..., :-1]
+    growth = np.divide(
+        Nw_arr[..., 1:] - Nw_prev,
+        interval * dtau * Nw_prev,
+        out=np.zeros_like(Nw_prev),
+        where=Nw_prev != 0,
+    )
+    Egr = np.where(Nw_prev != 0, S_arr[..., :-1] - growth, 0.0)
+    Egr_mean = np.mean(Egr, axis=-1)
     return Egr_mean
+
+
+# 一组 lag 的 growth estimator 序列，一次广播计算
+# lag 为 k 时 Egr_i = <S>_{i..i+k-1} - (N_{i+k} / N_i - 1) / (k A dtau)，N_i 为 0 时记为 0
+# k = 1 时与 cal_growth_estimator 的每一项相同；各个 lag 都取同样的起点 i，序列等长
+def growth_estimator_series(trace, dtau, lags, drop_ratio, state=0):
+    """
+    返回 (lags, Egr)，Egr 的形状为 (len(lags), m)，state 为 None 时为 (NS, len(lags), m)
+    """
+    if not (0.0 <= drop_ratio < 1.0):
+        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+
+    lags = np.atleast_1d(np.asarray(lags, dtype=int))
+    if np.any(lags < 1):
+        raise ValueError("lag 必须是正整数。")
+    steps = np.asarray(trace["steps"], dtype=int)
+    Nw_arr = state_data(trace["Nw"], state)
+    S_arr = state_data(trace["S"], state)
+    n = steps.size
+    interval = steps[1] - steps[0]
+    drop_n = int(n * drop_ratio)
+    m = n - drop_n - lags.max()
+    if m < 1:
+        raise ValueError(
+            "丢弃后的数据点数不多于最大的 lag，无法计算 growth estimator。"
+        )
+
+    S_arr = S_arr[..., drop_n:]
+    Nw_arr = Nw_arr[..., drop_n:]
+    # S 在 [i, i+k) 上的平均用前缀和得到
+    S_prefix = np.zeros(S_arr.shape[:-1] + (S_arr.shape[-1] + 1,))
+    np.cumsum(S_arr, axis=-1, out=S_prefix[..., 1:])
+
+    # 逐个 lag 写入预先分配的结果，每个 lag 取连续的切片，临时数组只有 O(NS m)
+    Nw_start = Nw_arr[..., :m]
+    invalid = Nw_start == 0
+    Egr = np.empty(S_arr.shape[:-1] + (lags.size, m))
+    growth = np.empty(Nw_start.shape)
+    for j, k in enumerate(lags):
+        out = Egr[..., j, :]
+        np.subtract(S_prefix[..., k : k + m], S_prefix[..., :m], out=out)
+        out /= k
+        growth.fill(1.0)
+        np.divide(Nw_arr[..., k : k + m], Nw_start, out=growth, where=~invalid)
+        growth -= 1.0
+        growth /= k * interval * dtau
+        out -= growth
+        np.copyto(out, 0.0, where=invalid)
+    return lags, Egr
+
+
+# 扫描一组 lag 的 growth estimator，每个 lag 给出均值与块分析平台处的误差
+# lag 小时偏差小、噪声大，lag 大时相反，用来选择合适的 lag
+def cal_growth_estimator_sweep(trace, dtau, lags, drop_ratio, state=0):
+    """
+    返回 (lags, Egr_mean, Egr_err)，state 为 None 时后两者为 (NS, len(lags))
+    """
+    lags, Egr = growth_estimator_series(trace, dtau, lags, drop_ratio, state)
+    std_errs, _ = fast_block_analysis(Egr)
+    Egr_err = plateau_error(std_errs, Egr.shape[-1])
+    return lags, Egr.mean(axis=-1), Egr_err
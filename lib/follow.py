@@ -0,0 +1,128 @@
+"""
+跟踪正在运行的 FCIQMC 任务的 trace 文件
+
+记住上次读到的字节位置，每次只解析新追加的完整行，末尾不完整的行留到下次。
+均值与块分析用 BlockingAccumulator 增量更新，刷新的开销只与新数据量有关。
+"""
+
+import os
+
+import numpy as np
+
+from .block import BlockingAccumulator
+from .compression import is_compressed
+from .read_file import (
+    CHUNK_SIZE,
+    NORMAL_COLUMNS,
+    REPLICA_COLUMNS,
+    _parse_chunk,
+    detect_trace_type,
+    trace_dtype,
+)
+
+
+class TraceFollower:
+    def __init__(self, filename, drop_ratio=0.0, chunk_size=CHUNK_SIZE):
+        """
+        drop_ratio: 0~1 之间的小数，按第一次读取时的数据量确定丢弃的步数，之后保持不变
+        """
+        if not (0.0 <= drop_ratio < 1.0):
+            raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+
+        if is_compressed(filename):
+            raise ValueError(
+                "压缩的 trace 文件不会再追加数据，请直接分析，不要用 follow"
+            )
+        self.filename = filename
+        self.drop_ratio = drop_ratio
+        self.chunk_size = chunk_size
+        self.trace_type = detect_trace_type(filename)
+        columns = REPLICA_COLUMNS if self.trace_type == "replica" else NORMAL_COLUMNS
+        self.dtype = trace_dtype(columns)
+        # 除 step 与 sidx 以外的列都放进块分析
+        self.observables = columns[2:]
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.drop_n = None  # 每个态丢弃的行数，第一次读取后确定
+        self.last_step = None
+        self.rows = {}  # sidx -> 已读行数
+        self.acc = {}  # sidx -> BlockingAccumulator
+
+    # 读取新追加的完整行，返回新行数
+    def update(self):
+        size = os.path.getsize(self.filename)
+        if size < self.offset:
+            # 文件被截短或重新写过，从头读
+            print("trace 文件变短，重新读取。")
+            self._reset()
+
+        new_rows = 0
+        first = []  # 第一次读取时先攒起来，确定丢弃的行数后再加入
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            rest = b""
+            while True:
+                block = f.read(self.chunk_size)
+                if not block:
+                    break
+                block = rest + block
+                cut = block.rfind(b"\n") + 1
+                rest = block[cut:]
+                if cut == 0:
+                    continue
+                chunk = _parse_chunk(block[:cut], self.dtype)
+                self.offset += cut
+                new_rows += chunk.size
+                if self.drop_n is None:
+                    first.append(chunk)
+                else:
+                    # 逐块加入，不保留原始数据
+                    self._feed(chunk)
+
+        if self.drop_n is None and new_rows > 0:
+            data = np.concatenate(first)
+            counts = np.unique(data["sidx"], return_counts=True)[1]
+            self.drop_n = int(counts.min() * self.drop_ratio)
+            self._feed(data)
+        return new_rows
+
+    # 按态拆分一块数据，跳过每个态开头 drop_n 行，其余加入块分析
+    def _feed(self, chunk):
+        if chunk.size == 0:
+            return
+        self.last_step = int(chunk["step"][-1])
+        values = np.column_stack([chunk[name] for name in self.observables])
+        for sidx in np.unique(chunk["sidx"]):
+            rows = values[chunk["sidx"] == sidx]
+            seen = self.rows.get(sidx, 0)
+            self.rows[sidx] = seen + rows.shape[0]
+            skip = max(0, self.drop_n - seen)
+            if sidx not in self.acc:
+                self.acc[sidx] = BlockingAccumulator(len(self.observables))
+            if skip < rows.shape[0]:
+                self.acc[sidx].add(rows[skip:])
+
+    # 已出现的态，按 sidx 排序，state 参数是其中的序号，与 trace["E"][state] 一致
+    def states(self):
+        return sorted(self.acc)
+
+    # 某个态当前的统计结果
+    def summary(self, state=0):
+        sidx = self.states()[state]
+        acc = self.acc[sidx]
+        col = {name: i for i, name in enumerate(self.observables)}
+        mean = acc.mean()
+        result = {
+            "step": self.last_step,
+            "rows": self.rows[sidx],
+            "used": acc.n,
+            "E": mean[col["E"]] / mean[col["norm"]],
+            "J2": mean[col["J2"]] / mean[col["norm"]],
+            "block_E": acc.ratio_block_errors(col["E"], col["norm"]),
+        }
+        if "S" in col:
+            result["S"] = mean[col["S"]]
+            result["block_S"] = acc.block_errors(col["S"])
+        return result
@@ -0,0 +1,148 @@
+"""
+log 文件的分段索引
+
+用 mmap 扫描一遍 log，记下每个 "warm up for <name>" 段的起止字节位置，
+索引缓存在 log 文件旁边的 <log>.sections.json 中（键与 trace 缓存相同），
+之后只读取需要的段，不必把整个 log 读进内存。
+压缩的 log 不能 mmap，扫描与读取都要从头顺序解压。
+"""
+
+import json
+import mmap
+import os
+import re
+import string
+
+import numpy as np
+
+from .compression import is_compressed
+from .read_file import iter_line_blocks
+from .trace_cache import cache_key
+
+SECTION_MARKER = b"warm up for "
+
+# step: 100, walker number: 12345.6
+WALKER_PATTERN = re.compile(
+    rb"step:\s*(\d+),\s*walker number:\s*([+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)"
+)
+
+
+def _index_file(filename):
+    return filename + ".sections.json"
+
+
+# 标记后的第一个词作为段名，去掉末尾的标点（例如 "fciqmc1," 中的逗号），没有时返回 None
+def _section_name(rest):
+    words = rest.split()
+    if not words:
+        return None
+    return words[0].decode(errors="ignore").rstrip(string.punctuation) or None
+
+
+# 扫描 log，返回 {段名: [起始字节, 结束字节]}，段从标记行开始，到下一个标记或文件末尾结束
+# 同名的段只记第一次出现的位置；压缩的 log 记录解压后的字节位置
+def _scan_sections(filename, marker=SECTION_MARKER):
+    if is_compressed(filename):
+        return _scan_stream_sections(filename, marker)
+    starts = []
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(marker)
+            while pos >= 0:
+                eol = mm.find(b"\n", pos)
+                eol = size if eol < 0 else eol
+                name = _section_name(mm[pos + len(marker) : eol])
+                line_start = mm.rfind(b"\n", 0, pos) + 1
+                if name:
+                    starts.append((name, line_start))
+                pos = mm.find(marker, eol)
+
+    return _sections_from_starts(starts, size)
+
+
+# 标记行的 (段名, 起始字节) 列表转换成 {段名: [起始字节, 结束字节]}
+def _sections_from_starts(starts, size):
+    sections = {}
+    for i, (name, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else size
+        sections.setdefault(name, [start, end])
+    return sections
+
+
+# 压缩 log 的分段扫描：顺序解压，每块都是完整的行，标记行不会跨块
+def _scan_stream_sections(filename, marker):
+    starts = []
+    pos = 0
+    for block in iter_line_blocks(filename):
+        i = block.find(marker)
+        while i >= 0:
+            eol = block.find(b"\n", i)
+            eol = len(block) if eol < 0 else eol
+            name = _section_name(block[i + len(marker) : eol])
+            if name:
+                starts.append((name, pos + block.rfind(b"\n", 0, i) + 1))
+            i = block.find(marker, eol)
+        pos += len(block)
+    return _sections_from_starts(starts, pos)
+
+
+# 读取（必要时重建）log 的分段索引
+def index_log_sections(filename, use_cache=True):
+    index_file = _index_file(filename)
+    key = cache_key(filename)
+    if use_cache and os.path.isfile(index_file):
+        try:
+            with open(index_file, "r") as f:
+                cached = json.load(f)
+            if all(cached.get(k) == v for k, v in key.items()):
+                return cached["sections"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    sections = _scan_sections(filename)
+    if use_cache:
+        try:
+            with open(index_file, "w") as f:
+                json.dump(dict(key, sections=sections), f, indent=2)
+        except OSError as e:
+            print(f"写入 log 分段索引失败: {e}")
+    return sections
+
+
+# 按名字查找段的 [起始字节, 结束字节]，没有同名的段时与原来按子串查找
+# "warm up for <section>" 一样，取第一个以 section 开头的段
+def _find_section(sections, section):
+    if section in sections:
+        return sections[section]
+    for name, bounds in sections.items():
+        if name.startswith(section):
+            return bounds
+    raise ValueError(f"Cannot find 'warm up for {section}' in log.")
+
+
+# 读取某一段中所有的 (step, walker number)
+def read_section_walkers(filename, section="fciqmc1", use_cache=True):
+    """
+    返回
+    ----
+    steps : numpy.ndarray (int64)
+    walkers : numpy.ndarray (float64)
+    """
+    sections = index_log_sections(filename, use_cache=use_cache)
+    start, end = _find_section(sections, section)
+
+    steps = []
+    walkers = []
+    for block in iter_line_blocks(filename, start=start, stop=end):
+        pairs = WALKER_PATTERN.findall(block)
+        if pairs:
+            fields = np.array(pairs)
+            steps.append(fields[:, 0].astype(np.int64))
+            walkers.append(fields[:, 1].astype(np.float64))
+
+    if not steps:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(steps), np.concatenate(walkers)
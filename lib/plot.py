@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from .block import *
+from .trace_data import Trace
 
 
 def plot_trace(trace, state=0):
@@ -9,17 +10,18 @@ def plot_trace(trace, state=0):
 
     参数
     ----
-    trace : dict
-        read_trace_file() 返回的字典
+    trace : Trace
+        read_trace_auto() 返回的 trace，也可以是旧的字典
     state : int
         要绘图的态编号（默认 0，即第一个态）
     """
-    steps = trace["steps"]  # 一维数组
+    trace = Trace.from_mapping(trace)
+    steps = trace.steps  # 一维数组
 
     # 取指定态的数据
-    S = trace["S"][state]
-    E = trace["E"][state]
-    norm = trace["norm"][state]
+    S = trace.state("S", state)
+    E = trace.state("E", state)
+    norm = trace.state("norm", state)
     Enorm = E / norm
 
     # --- 画图 ---
@@ -42,22 +44,10 @@ def plot_block_e(trace, drop_ratio, state=0):
     丢弃前 drop_ratio 比例的数据
     drop_ratio: 0~1 之间的小数，例如 0.2 表示丢弃前 20%
     """
-    if not (0.0 <= drop_ratio < 1.0):
-        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
-
-    E_arr = np.asarray(trace["E"][state], dtype=float)
-    norm_arr = np.asarray(trace["norm"][state], dtype=float)
-    n = E_arr.size
-    if n == 0:
-        raise ValueError("data 为空，无法计算平均值。")
-
-    drop_n = int(n * drop_ratio)
-    if drop_n >= n:
-        raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
-
-    E_seg = E_arr[drop_n:]
-    norm_seg = norm_arr[drop_n:]
-    std_errs, std_err_errs = block_analysis_energy(E_seg, norm_seg)
+    trace = Trace.from_mapping(trace)
+    E_seg = trace.state("E", state, drop_ratio)
+    norm_seg = trace.state("norm", state, drop_ratio)
+    std_errs, std_err_errs = fast_block_analysis_energy(E_seg, norm_seg)
     n = len(std_errs)
     lengths = [1 << i for i in range(n)]
     # --- 画图 ---
@@ -89,28 +79,16 @@ def plot_block_se(trace, drop_ratio, state=0):
     丢弃前 drop_ratio 比例的数据
     drop_ratio: 0~1 之间的小数，例如 0.2 表示丢弃前 20%
     """
-    if not (0.0 <= drop_ratio < 1.0):
-        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
-
-    E_arr = np.asarray(trace["E"][state], dtype=float)
-    norm_arr = np.asarray(trace["norm"][state], dtype=float)
-    S_arr = np.asarray(trace["S"][state], dtype=float)
-    n = E_arr.size
-    if n == 0:
-        raise ValueError("data 为空，无法计算平均值。")
-
-    drop_n = int(n * drop_ratio)
-    if drop_n >= n:
-        raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
-
-    E_seg = E_arr[drop_n:]
-    norm_seg = norm_arr[drop_n:]
-    S_seg = S_arr[drop_n:]
-    std_errs, std_err_errs = block_analysis_energy(E_seg, norm_seg)
-    std_errs_S, std_err_errs_S = block_analysis(S_seg)
-
-    if len(std_errs) != len(std_errs_S):
-        raise ValueError("能量与 S 的块分析结果长度不一致！检查 block_analysis 函数。")
+    trace = Trace.from_mapping(trace)
+    E_seg = trace.state("E", state, drop_ratio)
+    norm_seg = trace.state("norm", state, drop_ratio)
+    S_seg = trace.state("S", state, drop_ratio)
+    # E、norm 与 S 一起分块，一次得到 E/norm 与 S 的误差
+    blocking = multi_block_analysis(
+        {"E": E_seg, "norm": norm_seg, "S": S_seg}, ratios=[("E", "norm")]
+    )
+    std_errs, std_err_errs = blocking["E/norm"]
+    std_errs_S, std_err_errs_S = blocking["S"]
 
     n = len(std_errs)
     lengths = [1 << i for i in range(n)]
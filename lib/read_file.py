@@ -1,78 +1,150 @@
+import io
+import mmap
+import os
+import re
+import warnings
+
 import numpy as np
 import sys
 
+from .archive import is_archive, read_archive
+from .compression import is_compressed, open_trace
+from .trace_cache import load_trace_cache, save_trace_cache
+from .trace_data import Trace
 
-# 读取非 replica 的 trace 文件
-def read_normal_trace_file(filename):
-    # 在胡师兄代码的启发下用 np 读取更快
-    data = np.loadtxt(filename, comments="#", delimiter=",", unpack=True)
-    step, sidx, Nw, S, E, J2, norm = data
-
-    steps = np.unique(step)
-    steps.sort()
-    unique_sidx = np.unique(sidx)
-    unique_sidx.sort()
-
-    # 将数据按态分类存储
-    arrays_list = [Nw, S, E, J2, norm]
-    result_arrays = [[arr[sidx == idx] for idx in unique_sidx] for arr in arrays_list]
-    Nw_arrays, S_arrays, E_arrays, J2_arrays, norm_arrays = result_arrays
+# trace 文件各列的名字，step 与 sidx 是整数
+NORMAL_COLUMNS = ("step", "sidx", "Nw", "S", "E", "J2", "norm")
+REPLICA_COLUMNS = ("step", "sidx", "E", "J2", "norm")
+INT_COLUMNS = ("step", "sidx")
 
-    # 每一个态的数据是一个 numpy 数组
-    trace = {
-        "steps": steps,
-        "Nw": Nw_arrays,
-        "S": S_arrays,
-        "E": E_arrays,
-        "J2": J2_arrays,
-        "norm": norm_arrays,
-    }
+# 分块读取时每块的字节数
+CHUNK_SIZE = 1 << 22
 
-    return trace
 
+# 每行解析成的结构化 dtype
+def trace_dtype(columns):
+    return np.dtype(
+        [(name, np.int64 if name in INT_COLUMNS else np.float64) for name in columns]
+    )
 
-# 读取 replica 的 trace，这个可能更对，log 输出的 E 与 J2 已经把 norm 除掉了
-# 应该分子分母分别平均，再相除
-def read_replica_trace_file(filename):
-    data = np.loadtxt(filename, comments="#", delimiter=",", unpack=True)
-    step, sidx, replica_E, replica_J2, norm = data
 
-    steps = np.unique(step)
-    steps.sort()
-    unique_sidx = np.unique(sidx)
-    unique_sidx.sort()
+# 只读取 observables 中的观测量时需要解析的列，step 与 sidx 总是需要
+# observables 为 None 时解析全部列，文件中没有的观测量跳过
+def project_columns(columns, observables=None):
+    if observables is None:
+        return tuple(columns)
+    return tuple(c for c in columns if c in INT_COLUMNS or c in observables)
+
+
+# 解析一块完整的行，返回结构化数组，每个字段是一列
+def _parse_chunk(buf, dtype):
+    if not buf.strip():
+        return np.empty(0, dtype=dtype)
+    with warnings.catch_warnings():
+        # 整块只有注释行时 loadtxt 会警告没有数据
+        warnings.simplefilter("ignore", UserWarning)
+        return np.loadtxt(
+            io.BytesIO(buf), dtype=dtype, comments="#", delimiter=",", ndmin=1
+        )
+
+
+# 从二进制文件对象中按块读取 trace，每次产出若干完整行解析成的结构化数组
+# 块末尾不完整的行留到下一块
+def iter_trace_chunks(f, columns, chunk_size=CHUNK_SIZE):
+    dtype = trace_dtype(columns)
+    rest = b""
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b"\n") + 1
+        rest = block[cut:]
+        if cut > 0:
+            yield _parse_chunk(block[:cut], dtype)
+    if rest.strip():
+        yield _parse_chunk(rest, dtype)
+
+
+# 读取 trace 中 keep 这些列，返回与 keep 对应的列表
+# np.loadtxt 一次解析整个文件（C 实现），比按块解析再拼接快
+# 文件通过 open_trace 打开，压缩文件按魔数识别，边解压边解析，与文件后缀无关
+def _read_trace_data(filename, columns, keep):
+    # 在胡师兄代码的启发下用 np 读取更快
+    usecols = [columns.index(name) for name in keep]
+    with open_trace(filename, "r") as f:
+        return np.loadtxt(
+            f,
+            comments="#",
+            delimiter=",",
+            unpack=True,
+            usecols=usecols,
+            ndmin=2,
+        )
+
+
+# 排序后去重，step 基本已经有序，比整数的 np.unique 快得多
+def _unique_sorted(arr):
+    arr = np.sort(arr)
+    if arr.size == 0:
+        return arr
+    return arr[np.concatenate(([True], arr[1:] != arr[:-1]))]
+
+
+# 一次把各列按态分开，返回与 arrays 对应的列表
+# 各态数据一样多时每列是一个连续的 (NS, nsteps) 数组，trace["E"][state] 是其中一行
+# 否则退回每个态一个数组的列表
+def split_by_state(sidx, unique_sidx, arrays):
+    ns = unique_sidx.size
+    n = sidx.size
+
+    # 常见情况：每个 step 依次输出所有态，行按固定步长 NS 交错
+    if ns > 0 and n % ns == 0:
+        rows = sidx.reshape(-1, ns)
+        if np.array_equal(rows[0], unique_sidx) and np.all(rows == rows[0]):
+            return [np.ascontiguousarray(arr.reshape(-1, ns).T) for arr in arrays]
+
+    # 一般情况：稳定排序一次，同一个态内保持原来的顺序
+    inverse = np.searchsorted(unique_sidx, sidx)
+    counts = np.bincount(inverse, minlength=ns)
+    order = np.argsort(inverse, kind="stable")
+    if np.all(counts == counts[0]):
+        return [arr[order].reshape(ns, -1) for arr in arrays]
+    bounds = np.cumsum(counts)[:-1]
+    return [np.split(arr[order], bounds) for arr in arrays]
+
+
+# 读取 trace 文件中 observables 这些观测量（None 为全部），按态分开存成 Trace
+def _read_trace_file(filename, columns, trace_type, observables):
+    keep = project_columns(columns, observables)
+    data = dict(zip(keep, _read_trace_data(filename, columns, keep)))
+    sidx = data.pop("sidx")
+    steps = _unique_sorted(data.pop("step"))
+    unique_sidx = _unique_sorted(sidx)
 
     # 将数据按态分类存储
-    arrays_list = [replica_E, replica_J2, norm]
-    result_arrays = [[arr[sidx == idx] for idx in unique_sidx] for arr in arrays_list]
-    replica_E_arrays, replica_J2_arrays, norm_arrays = result_arrays
+    # 每一个态的数据是一个 numpy 数组（(NS, nsteps) 数组的一行）
+    names = list(data)
+    result_arrays = split_by_state(sidx, unique_sidx, [data[n] for n in names])
+    return Trace(steps, dict(zip(names, result_arrays)), trace_type)
 
-    # 每一个态的数据是一个 numpy 数组
-    trace = {
-        "steps": steps,
-        "E": replica_E_arrays,
-        "J2": replica_J2_arrays,
-        "norm": norm_arrays,
-    }
 
-    return trace
+# 读取非 replica 的 trace 文件，observables 给出时只解析这些观测量
+def read_normal_trace_file(filename, observables=None):
+    return _read_trace_file(filename, NORMAL_COLUMNS, "normal", observables)
 
 
-def read_trace_auto(filename):
-    """
-    自动判断 trace 文件类型（replica / non-replica，也就是 normal），
-    调用对应的 read 函数。
+# 读取 replica 的 trace，这个可能更对，log 输出的 E 与 J2 已经把 norm 除掉了
+# 应该分子分母分别平均，再相除
+def read_replica_trace_file(filename, observables=None):
+    return _read_trace_file(filename, REPLICA_COLUMNS, "replica", observables)
 
-    返回
-    ----
-    trace : dict
-        trace 数据
-    trace_type : str
-        "replica" 或 "normal"
-    """
+
+# 根据 header 判断 trace 文件类型，返回 "replica" 或 "normal"
+def detect_trace_type(filename):
     # --- 读取 header ---
     header = None
-    with open(filename, "r") as f:
+    with open_trace(filename, "r") as f:
         for line in f:
             line = line.strip()
             if not line:
@@ -91,50 +163,177 @@ def read_trace_auto(filename):
 
     # --- 判断类型 ---
     if "replica_e" in header_lower:
-        trace = read_replica_trace_file(filename)
-        trace_type = "replica"
+        return "replica"
     elif "nw" in header_lower and "s" in header_lower:
-        trace = read_normal_trace_file(filename)
-        trace_type = "normal"
+        return "normal"
     else:
         raise ValueError(f"无法识别 trace 类型，header 为:\n{header}")
 
+
+def read_trace_auto(filename, use_cache=True, observables=None):
+    """
+    自动判断 trace 文件类型（replica / non-replica，也就是 normal），
+    调用对应的 read 函数。
+    filename 也可以是列式归档文件（见 archive），这时直接内存映射读取。
+    use_cache 为 True 时优先读取 trace 文件旁边的二进制缓存（见 trace_cache），
+    缓存不存在或失效时解析文本并重建缓存。
+    observables 给出时只读取这些观测量（例如 ("S",)），其他列不解析也不分配，
+    文件中没有的观测量跳过；None 表示全部。
+
+    返回
+    ----
+    trace : Trace
+        trace 数据，trace["E"][state] 的字典式访问仍然可用
+    trace_type : str
+        "replica" 或 "normal"
+    """
+    # --- 归档文件 ---
+    if is_archive(filename):
+        return read_archive(filename, observables)
+
+    # --- 读取缓存 ---
+    if use_cache:
+        cached = load_trace_cache(filename, observables)
+        if cached is not None:
+            return cached
+
+    trace_type = detect_trace_type(filename)
+    columns = REPLICA_COLUMNS if trace_type == "replica" else NORMAL_COLUMNS
+    if trace_type == "replica":
+        trace = read_replica_trace_file(filename, observables)
+    else:
+        trace = read_normal_trace_file(filename, observables)
+
+    if use_cache:
+        save_trace_cache(filename, trace, trace_type, columns[2:])
+
     return trace, trace_type
 
 
-# 暂时的读取 replica log 文件的函数
 # 需要读取的行形如 "sidx = 0: Replica E = -9.99271277, J2 = 0.66412419"
-# 当前只支持 NS = 1，只读一个态
-def read_replica_log(filename):
+# 没有 "sidx = k:" 前缀的旧格式当作态 0
+REPLICA_LOG_PATTERN = re.compile(
+    rb"(?:sidx\s*=\s*(\d+):\s*)?"
+    rb"Replica E\s*=\s*([+-eE0-9\.]+),\s*J2\s*=\s*([+-eE0-9\.]+)"
+)
+
+
+# 按块遍历文件中 [start, stop) 字节范围内的完整行，用 mmap 避免一次读入整个文件
+# start 应当在行首；压缩文件的位置是解压后的字节位置
+def iter_line_blocks(filename, chunk_size=CHUNK_SIZE, start=0, stop=None):
+    if is_compressed(filename):
+        yield from _iter_stream_blocks(filename, chunk_size, start, stop)
+        return
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if stop is not None:
+            size = min(size, stop)
+        if size <= start:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            while pos < size:
+                end = min(pos + chunk_size, size)
+                if end < size:
+                    cut = mm.rfind(b"\n", pos, end)
+                    if cut < 0:
+                        # 一行比块还长，找到这一行的结尾
+                        cut = mm.find(b"\n", end)
+                        cut = size - 1 if cut < 0 else cut
+                    end = cut + 1
+                yield mm[pos:end]
+                pos = end
+
+
+# 压缩文件的 iter_line_blocks：顺序解压，跳过 start 之前的部分
+def _iter_stream_blocks(filename, chunk_size, start, stop):
+    pos = 0  # block 在解压后数据中的起始位置
+    rest = b""
+    with open_trace(filename) as f:
+        while stop is None or pos < stop:
+            data = f.read(chunk_size)
+            block = rest + data
+            if not block:
+                break
+            # 读完后剩下的最后一行没有换行符
+            cut = block.rfind(b"\n") + 1 if data else len(block)
+            if cut == 0:
+                rest = block
+                continue
+            rest = block[cut:]
+            lo = max(start - pos, 0)
+            hi = cut if stop is None else min(cut, stop - pos)
+            if lo < hi:
+                yield block[lo:hi]
+            pos += cut
+
+
+# 流式读取 replica log，支持多个态，读取的同时按态抽样
+def scan_replica_log(filename, start=0, interval=1, chunk_size=CHUNK_SIZE):
+    """
+    从 log 中读取所有 'sidx = k: Replica E = ..., J2 = ...' 行，按态分开。
+    每个态只保留第 start, start + interval, start + 2*interval, ... 条记录
+    （与 arr[start::interval] 相同），抽样在解析时完成，内存只与保留的数据量有关。
+
+    返回 dict:
+        log["sidx"] -> 出现过的态编号（排序后）
+        log["E"]    -> 各态数据一样多时为 (NS, n) 数组，否则为每个态一个数组的列表
+        log["J2"]   -> 同上
+    """
+    counters = {}  # sidx -> 该态已经读到的记录数
+    kept = {}  # sidx -> [(E, J2), ...] 每块保留的数据
+
+    for block in iter_line_blocks(filename, chunk_size):
+        matches = REPLICA_LOG_PATTERN.findall(block)
+        if not matches:
+            continue
+        fields = np.array(matches)
+        sidx = np.zeros(len(fields), dtype=np.int64)
+        has_sidx = fields[:, 0] != b""
+        sidx[has_sidx] = fields[has_sidx, 0].astype(np.int64)
+        values = fields[:, 1:].astype(np.float64)
+
+        for k in np.unique(sidx):
+            rows = values[sidx == k]
+            # 这一块的记录在该态中的序号
+            index = counters.get(k, 0) + np.arange(rows.shape[0])
+            counters[k] = counters.get(k, 0) + rows.shape[0]
+            keep = (index >= start) & ((index - start) % interval == 0)
+            kept.setdefault(k, []).append(rows[keep])
+
+    states = sorted(kept)
+    per_state = [
+        np.concatenate(kept[k]) if kept[k] else np.empty((0, 2)) for k in states
+    ]
+    E = [rows[:, 0] for rows in per_state]
+    J2 = [rows[:, 1] for rows in per_state]
+    if len({len(e) for e in E}) == 1:
+        E = np.array(E)
+        J2 = np.array(J2)
+
+    return {"sidx": np.array(states, dtype=np.int64), "E": E, "J2": J2}
+
+
+# 读取 replica log 文件中某个态的 E 与 J2
+def read_replica_log(filename, state=0):
     """
     从输出文件中读取所有
     'Replica E = ..., J2 = ...'
     行，返回一个 dict，包含:
         log["E"]  -> numpy.ndarray
         log["J2"] -> numpy.ndarray
+    state 是态的序号，与 trace["E"][state] 相同
     """
-    dt = np.dtype(
-        [
-            ("E", np.float64),
-            ("J2", np.float64),
-        ]
-    )
-
-    # Replica E = -9.99507344, J2 = 0.65899345
-    pattern = r"Replica E\s*=\s*([+-eE0-9\.]+),\s*J2\s*=\s*([+-eE0-9\.]+)"
+    log = scan_replica_log(filename)
+    if len(log["sidx"]) == 0:
+        raise ValueError("log 文件中没有找到 Replica E 与 J2 的数据。")
 
-    arr = np.fromregex(filename, pattern, dt)
+    print(f"共取到 {len(log['E'][state])} 个数据点。")
 
-    print(f"共取到 {len(arr)} 个数据点。")
+    return {"E": log["E"][state], "J2": log["J2"][state]}
 
-    log = {
-        "E": arr["E"].copy(),  # 拷贝成普通的 1D array
-        "J2": arr["J2"].copy(),
-    }
-    return log
 
-
-def read_replica_log_interval(filename, interval=10):
+def read_replica_log_interval(filename, interval=10, state=0, start=9):
     """
     从输出文件中读取所有
     'Replica E = ..., J2 = ...'
@@ -142,26 +341,12 @@ def read_replica_log_interval(filename, interval=10):
         log["E"]  -> numpy.ndarray
         log["J2"] -> numpy.ndarray
     """
-    dt = np.dtype(
-        [
-            ("E", np.float64),
-            ("J2", np.float64),
-        ]
-    )
-
-    # Replica E = -9.99507344, J2 = 0.65899345
-    pattern = r"Replica E\s*=\s*([+-eE0-9\.]+),\s*J2\s*=\s*([+-eE0-9\.]+)"
-
-    arr = np.fromregex(filename, pattern, dt)
-
     # 原先的写法是第 10 步开始输出，每隔 10 步输出一次
     # 原输出的第 10 步对应的是程序的第 100 步，每隔 10 步读取也对应程序的每隔 100 步输出
-    arr = arr[9::interval]
+    log = scan_replica_log(filename, start=start, interval=interval)
+    if len(log["sidx"]) == 0:
+        raise ValueError("log 文件中没有找到 Replica E 与 J2 的数据。")
 
-    print(f"共取到 {len(arr)} 个数据点。")
+    print(f"共取到 {len(log['E'][state])} 个数据点。")
 
-    log = {
-        "E": arr["E"].copy(),  # 拷贝成普通的 1D array
-        "J2": arr["J2"].copy(),
-    }
-    return log
+    return {"E": log["E"][state], "J2": log["J2"][state]}
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 from .block import *
 
 """
@@ -49,8 +48,11 @@ def plot_replica_block(data, drop_ratio):
     if drop_n >= n:
         raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
 
+    # 画图时才导入 matplotlib，只算均值时不用付出导入的时间
+    import matplotlib.pyplot as plt
+
     tail = arr[drop_n:]
-    std_errs, std_err_errs = block_analysis(tail)
+    std_errs, std_err_errs = fast_block_analysis(tail)
     n = len(std_errs)
     lengths = [1 << i for i in range(n)]
     # --- 画图 ---
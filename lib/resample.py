@@ -0,0 +1,192 @@
+"""
+块 bootstrap 与 jackknife 重采样误差
+
+先把数据分成大小为 block_size 的块并求块均值（与块分析一样从结尾对齐），之后每次重采样
+只需要块均值：bootstrap 用随机抽取的块计数矩阵乘块均值，jackknife 用总和减去一块。
+估计量写成各列均值的函数，例如 E/norm 是 E 列均值除以 norm 列均值，
+重加权的 E 是 W*E 与 W*norm 两列均值之比，因此比 delta 方法更适合 norm 噪声大的情况。
+bootstrap 的重采样按块分给线程池计算，每块用由 seed 派生的独立随机数，
+结果只与 seed 有关，与线程数无关。
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .analysis import REWEIGHT_ORDER_E, REWEIGHT_ORDER_S
+from .block import block_covariance, optimal_block
+from .cal import cal_mean, state_data
+from .estimator import growth_estimator_series
+from .reweight_tools import cal_reweight_factor
+
+N_RESAMPLES = 2000
+# 自动选择块大小时至少保留的块数
+MIN_BLOCKS = 20
+# 每个线程一次处理的 (重采样次数 x 块数) 上限，控制内存
+CHUNK_ELEMENTS = 1 << 22
+
+
+# 自动选择块大小：各列块分析平台处块大小的最大值，且至少保留 MIN_BLOCKS 块
+def choose_block_size(data):
+    data = np.asarray(data, dtype=float)
+    n = data.shape[-1]
+    means, covs, nums = block_covariance(data)
+    level = 0
+    for i in range(data.shape[0]):
+        std_errs = [np.sqrt(cov[i, i]) for cov in covs]
+        k = optimal_block(std_errs, n)
+        level = max(level, len(std_errs) - 1 if k is None else k)
+    while level > 0 and nums[level] < MIN_BLOCKS:
+        level -= 1
+    return 1 << level
+
+
+# 沿最后一个轴求块均值，从结尾对齐，开头不足一块的数据跳过
+def block_means(data, block_size):
+    data = np.asarray(data, dtype=float)
+    n = data.shape[-1]
+    nb = n // block_size
+    if nb < 2:
+        raise ValueError("数据太少，块数不足 2，无法重采样。")
+    data = data[..., n - nb * block_size :]
+    return data.reshape(*data.shape[:-1], nb, block_size).mean(axis=-1)
+
+
+# 块 bootstrap：返回 (ncols, n_resamples)，每一列是一次重采样的各列均值
+def bootstrap_means(blocks, n_resamples=N_RESAMPLES, seed=None, workers=None):
+    blocks = np.asarray(blocks, dtype=float)
+    nb = blocks.shape[-1]
+    chunk = max(1, min(n_resamples, CHUNK_ELEMENTS // nb))
+    sizes = [min(chunk, n_resamples - i) for i in range(0, n_resamples, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    def run(size, seed_seq):
+        rng = np.random.default_rng(seed_seq)
+        idx = rng.integers(0, nb, size=(size, nb), dtype=np.int32)
+        # 每次重采样中每块被抽到的次数，乘块均值得到重采样的均值
+        offset = (np.arange(size, dtype=np.int64) * nb)[:, None]
+        counts = np.bincount((idx + offset).ravel(), minlength=size * nb)
+        return blocks @ counts.reshape(size, nb).T.astype(float) / nb
+
+    if workers is None:
+        workers = os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(run, sizes, seeds))
+    return np.concatenate(parts, axis=-1)
+
+
+# 删一块 jackknife：返回 (ncols, nb)，第 j 列是去掉第 j 块后的各列均值
+def jackknife_means(blocks):
+    blocks = np.asarray(blocks, dtype=float)
+    nb = blocks.shape[-1]
+    return (blocks.sum(axis=-1, keepdims=True) - blocks) / (nb - 1)
+
+
+# 用重采样估计 func(各列均值) 的误差
+def resample_error(
+    func,
+    data,
+    method="bootstrap",
+    block_size=None,
+    n_resamples=N_RESAMPLES,
+    seed=None,
+    workers=None,
+):
+    """
+    func: 由各列均值计算估计量的函数，输入 (ncols, ...) 的数组，返回 (...)
+    data: (ncols, N)，每一行是一个参与计算的量
+    method: "bootstrap" 或 "jackknife"
+    返回 (估计值, 误差, block_size)
+    """
+    data = np.asarray(data, dtype=float)
+    if block_size is None:
+        block_size = choose_block_size(data)
+    blocks = block_means(data, block_size)
+    estimate = func(data.mean(axis=-1))
+
+    if method == "bootstrap":
+        values = func(bootstrap_means(blocks, n_resamples, seed, workers))
+        err = np.std(values, ddof=1)
+    elif method == "jackknife":
+        values = func(jackknife_means(blocks))
+        nb = values.shape[-1]
+        err = np.sqrt((nb - 1) / nb * np.sum((values - values.mean()) ** 2))
+    else:
+        raise ValueError(f"未知的重采样方法: {method}，可选 bootstrap、jackknife")
+    return estimate, err, block_size
+
+
+# 对 trace 中某个态的 E/norm、J2/norm、重加权 E 与 S、growth estimator 做重采样误差
+def resample_analysis(
+    trace,
+    dtau,
+    drop_ratio,
+    state=0,
+    method="bootstrap",
+    n_resamples=N_RESAMPLES,
+    seed=None,
+    workers=None,
+    block_size=None,
+):
+    """
+    返回 {名字: {"value", "err", "block_size"}}，replica trace 只有 E 与 J2
+    每个估计量的块大小单独自动选择，也可以用 block_size 统一指定
+    """
+    if not (0.0 <= drop_ratio < 1.0):
+        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+
+    norm = state_data(trace["norm"], state)
+    drop_n = int(norm.size * drop_ratio)
+    estimators = {}
+
+    def ratio(m):
+        return m[0] / m[1]
+
+    for name in ("E", "J2"):
+        data = state_data(trace[name], state)
+        estimators[name] = (ratio, [data[drop_n:], norm[drop_n:]])
+
+    if "S" in trace:
+        E = state_data(trace["E"], state)
+        start_idx, W = cal_reweight_factor(
+            trace, dtau, REWEIGHT_ORDER_E, drop_ratio=drop_ratio, state=state
+        )
+        estimators["E_rw"] = (ratio, [W * E[start_idx:], W * norm[start_idx:]])
+
+        # 与 cal_reweight_S 相同：order 与 order + 10 两组权重
+        start_n, W_n = cal_reweight_factor(
+            trace, dtau, REWEIGHT_ORDER_S, drop_ratio=drop_ratio, state=state
+        )
+        start_n1, W_n1 = cal_reweight_factor(
+            trace, dtau, REWEIGHT_ORDER_S + 10, drop_ratio=drop_ratio, state=state
+        )
+        steps = np.asarray(trace["steps"], dtype=int)
+        interval = steps[1] - steps[0]
+        Nw = state_data(trace["Nw"], state)
+        C = cal_mean(state_data(trace["S"], state), drop_ratio)
+
+        def reweight_S(m):
+            return C - np.log(m[0] / m[1]) / (interval * dtau)
+
+        estimators["S_rw"] = (
+            reweight_S,
+            [W_n1 * Nw[start_n1:], W_n[:-1] * Nw[start_n:-1]],
+        )
+
+        _, Egr = growth_estimator_series(trace, dtau, [1], drop_ratio, state)
+        estimators["Egr"] = (lambda m: m[0], Egr)
+
+    result = {}
+    for name, (func, data) in estimators.items():
+        value, err, size = resample_error(
+            func,
+            np.asarray(data),
+            method=method,
+            block_size=block_size,
+            n_resamples=n_resamples,
+            seed=seed,
+            workers=workers,
+        )
+        result[name] = {"value": value, "err": err, "block_size": size}
+    return result
@@ -17,12 +17,13 @@ def cal_reweight_factor(trace, dtau, order, drop_ratio, state=0):
     """
     丢弃前 drop_ratio 比例的数据
     drop_ratio: 0~1 之间的小数，例如 0.2 表示丢弃前 20%
+    state 为 None 时同时计算所有态，W 的形状为 (NS, length)，start_idx 所有态相同
     """
     if not (0.0 <= drop_ratio < 1.0):
         raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
 
     steps = np.asarray(trace["steps"], dtype=int)
-    S_arr = np.asarray(trace["S"][state], dtype=float)
+    S_arr = state_data(trace["S"], state)
     n = steps.size
 
     interval = steps[1] - steps[0]
@@ -31,7 +32,20 @@ def cal_reweight_factor(trace, dtau, order, drop_ratio, state=0):
     if drop_n >= n:
         raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
 
-    # 确定了计算的起始位置与其 idx，steps 是没丢弃前百分比的，因此 S_arr 也不能丢弃
+    es = cal_mean(S_arr, drop_ratio)
+    ee = cal_mean(state_data(trace["E"], state), drop_ratio)
+    enorm = cal_mean(state_data(trace["norm"], state), drop_ratio)
+    ee /= enorm
+    C = es
+    print(f"Reweighting parameters: <S> = {es}, <E> = {ee}")
+
+    # steps 是没丢弃前百分比的，因此 S_arr 也不能丢弃
+    return _reweight_factor(steps, S_arr, dtau, order, drop_n, interval, C)
+
+
+# 给定 C 计算权重，prefix 是 cal_S_prefix(S_arr, interval)，扫描多个 order 时可以复用
+def _reweight_factor(steps, S_arr, dtau, order, drop_n, interval, C, prefix=None):
+    # 确定了计算的起始位置与其 idx
     cut_step = steps[drop_n]
     start_step = cut_step + order
     if start_step % interval != 0:
@@ -44,24 +58,78 @@ def cal_reweight_factor(trace, dtau, order, drop_ratio, state=0):
     if length <= 0:
         raise ValueError(f"丢弃数据后，剩余数据无法满足给定 order = {order} 的计算。")
 
-    logW = np.zeros(length, dtype=float)
-    es = cal_mean(trace["S"][state], drop_ratio)
-    ee = cal_mean(trace["E"][state], drop_ratio)
-    enorm = cal_mean(trace["norm"][state], drop_ratio)
-    ee /= enorm
-    C = es
-    print(f"Reweighting parameters: <S> = {es}, <E> = {ee}")
-    for i in range(length):
-        idx = start_idx + i
-        step_x1 = steps[idx] - order
-        step_x2 = steps[idx] - 1
-        sum_S = sum_S_x1x2(S_arr, steps, step_x1, step_x2, interval)
-        logW[i] = -dtau * (sum_S - order * C)
+    # 所有窗口 [step - order, step - 1] 一次算完，用前缀和代替逐个 sum_S_x1x2
+    step_x2 = steps[start_idx:] - 1
+    step_x1 = steps[start_idx:] - order
+    sum_S = sum_S_windows(S_arr, steps, step_x1, step_x2, interval, C=C, prefix=prefix)
+    logW = -dtau * sum_S
 
     W = np.exp(logW)
     return start_idx, W
 
 
+# S 的前缀和，prefix[k] 是前 k 个 S 块（每块 A 步）的和
+# S_data 可以是 (NS, nsteps)，沿最后一个轴累加
+def cal_S_prefix(S_data, A):
+    S_data = np.asarray(S_data, dtype=float)
+    prefix = np.zeros(S_data.shape[:-1] + (S_data.shape[-1] + 1,), dtype=float)
+    np.cumsum(S_data * A, axis=-1, out=prefix[..., 1:])
+    return prefix
+
+
+# 每个态一个的常数 (NS,) 变成 (NS, 1)，便于与 (NS, nsteps) 的数据广播
+def _per_state(C):
+    C = np.asarray(C, dtype=float)
+    return C[..., None] if C.ndim > 0 else C
+
+
+# 找到 step c（A 的倍数）所在 S 块的下标，等距的 steps 直接算，不等距时用 searchsorted
+def _block_index(steps, c, A):
+    n = steps.size
+    if n > 1 and steps[-1] - steps[0] == (n - 1) * A:
+        k = (c - steps[0]) // A
+        return np.clip(k, 0, n)
+    return np.searchsorted(steps, c)
+
+
+# 每一步的 S 从开头累加到 step t（含 t）的和，t 可以是数组
+def _cumulative_S(S_data, steps, t, A, prefix):
+    n = steps.size
+    # t 所在的块的结束 step，也就是这一步用的 S 对应的 step
+    c = -((-t) // A) * A
+    k = _block_index(steps, c, A)
+    k_safe = np.minimum(k, n - 1)
+    found = (k < n) & (steps[k_safe] == c)
+    # 块 k 之前的整块，加上块 k 中 t 以前（含 t）的步数
+    partial = np.where(found, (t - (c - A)) * S_data[..., k_safe], 0.0)
+    return prefix[..., k] + partial
+
+
+# sum_S_x1x2 的向量化版本，x1, x2 可以是数组，一次算出所有 [x1, x2] 窗口的 S 之和
+def sum_S_windows(S_data, steps, x1, x2, A, C=0.0, prefix=None):
+    """
+    计算每个窗口从 step x1 到 x2 的 S 之和减去 (x2 - x1 + 1) * C，
+    结果与逐个调用 sum_S_x1x2(S_data, steps, x1, x2, A) - (x2 - x1 + 1) * C 相同。
+    steps 中缺失的 step 不计入 S 之和，但仍然减去 C，与 cal_reweight_factor 原来的写法一致。
+    S_data: S值的数组 (numpy array)，或所有态的 (NS, nsteps) 数组
+    steps:  对应的步数数组 (numpy array)
+    x1, x2: 起始步和结束步数组 (闭区间 [x1, x2])
+    A:      间隔 (interval)
+    C:      窗口中每一步减去的常数，默认 0，所有态时为 (NS,)
+    prefix: cal_S_prefix(S_data, A) 的结果，多次调用时可以传入复用
+    """
+    S_data = np.asarray(S_data, dtype=float)
+    steps = np.asarray(steps, dtype=int)
+    x1 = np.asarray(x1, dtype=int)
+    x2 = np.asarray(x2, dtype=int)
+    if prefix is None:
+        prefix = cal_S_prefix(S_data, A)
+
+    upper = _cumulative_S(S_data, steps, x2, A, prefix)
+    lower = _cumulative_S(S_data, steps, x1 - 1, A, prefix)
+    return upper - lower - (x2 - x1 + 1) * _per_state(C)
+
+
 # 给定 step x1 与 x2，一共的数据数就是 n = order 个，用这些 S 加起来
 def sum_S_x1x2(S_data, steps, x1, x2, A):
     """
@@ -128,14 +196,15 @@ def cal_reweight_energy(E_data, norm_data, start_idx, W):
     E_data: 能量数组 (numpy array)
     norm_data: 归一化数组 (numpy array)
     W: 权重数组 (numpy array)
+    三者也可以都是 (NS, nsteps) 的所有态数据，此时返回 (NS,)
     """
-    E_data = E_data[start_idx:]
-    norm_data = norm_data[start_idx:]
-    if len(E_data) != len(W) or len(norm_data) != len(W):
+    E_data = np.asarray(E_data, dtype=float)[..., start_idx:]
+    norm_data = np.asarray(norm_data, dtype=float)[..., start_idx:]
+    if E_data.shape != W.shape or norm_data.shape != W.shape:
         raise ValueError("E_data, norm_data 与 W 的长度必须相同。")
-    weighted_E = np.sum(W * E_data)
-    sum_W = np.sum(W * norm_data)
-    if sum_W == 0:
+    weighted_E = np.sum(W * E_data, axis=-1)
+    sum_W = np.sum(W * norm_data, axis=-1)
+    if np.any(sum_W == 0):
         raise ValueError("权重和为零，无法计算加权能量。")
     return weighted_E / sum_W
 
@@ -149,17 +218,24 @@ def cal_reweight_S(trace, dtau, order, drop_ratio, state=0):
         trace, dtau, order + 10, drop_ratio=drop_ratio, state=state
     )
 
-    # 检查
-    if len(W_n) != len(W_n1):
-        if len(W_n) != len(W_n1) + 1:
-            raise ValueError("计算重加权 S 时，W_n 长度应该为 W_n1 加 1。")
-
     steps = np.asarray(trace["steps"], dtype=int)
     interval = steps[1] - steps[0]
-    Nw_arr = np.asarray(trace["Nw"][state], dtype=float)
-    S_arr = np.asarray(trace["S"][state], dtype=float)
+    Nw_arr = state_data(trace["Nw"], state)
+    S_arr = state_data(trace["S"], state)
     C = cal_mean(S_arr, drop_ratio)
 
+    return _reweight_S(
+        steps, Nw_arr, C, dtau, interval, start_idx_n, W_n, start_idx_n1, W_n1
+    )
+
+
+# 由 order 与 order + 10 两组权重计算重加权的 S
+def _reweight_S(steps, Nw_arr, C, dtau, interval, start_idx_n, W_n, start_idx_n1, W_n1):
+    # 检查
+    if W_n.shape[-1] != W_n1.shape[-1]:
+        if W_n.shape[-1] != W_n1.shape[-1] + 1:
+            raise ValueError("计算重加权 S 时，W_n 长度应该为 W_n1 加 1。")
+
     start_step_n = steps[start_idx_n]
     start_step_n1 = steps[start_idx_n1]
     if start_step_n1 != start_step_n + interval:
@@ -167,21 +243,78 @@ def cal_reweight_S(trace, dtau, order, drop_ratio, state=0):
             "计算重加权 S 时，start_idx_n1 对应的 step 应该比 start_idx_n 多一个间隔。"
         )
 
-    Wn_seg = W_n[:-1]
+    Wn_seg = W_n[..., :-1]
     Wn1_seg = W_n1
-    Nn_seg = Nw_arr[start_idx_n:-1]
-    Nn1_seg = Nw_arr[start_idx_n1:]
+    Nn_seg = Nw_arr[..., start_idx_n:-1]
+    Nn1_seg = Nw_arr[..., start_idx_n1:]
     # 检查
     if (
-        len(Wn_seg) != len(Wn1_seg)
-        or len(Wn_seg) != len(Nn_seg)
-        or len(Wn_seg) != len(Nn1_seg)
+        Wn_seg.shape != Wn1_seg.shape
+        or Wn_seg.shape != Nn_seg.shape
+        or Wn_seg.shape != Nn1_seg.shape
     ):
         raise ValueError("计算重加权 S 时，各数组长度不匹配。")
 
     # 计算 S
     reweight_S = C - (1 / (interval * dtau)) * np.log(
-        np.sum(Wn1_seg * Nn1_seg) / np.sum(Wn_seg * Nn_seg)
+        np.sum(Wn1_seg * Nn1_seg, axis=-1) / np.sum(Wn_seg * Nn_seg, axis=-1)
     )
 
     return reweight_S
+
+
+# 一次扫描多个 order，共用同一份 trace 与同一个前缀和，返回每个 order 的重加权 E 与 S
+def cal_reweight_sweep(trace, dtau, orders, drop_ratio, state=0):
+    """
+    对 orders 中的每个 order 计算重加权能量（同 cal_reweight_energy）
+    与重加权 S（同 cal_reweight_S）。
+    orders: order 的列表或 range
+    drop_ratio: 0~1 之间的小数，例如 0.2 表示丢弃前 20%
+    返回 (orders, E_rw, S_rw)，都是 numpy 数组，某个 order 无法计算时对应位置为 nan
+    state 为 None 时同时计算所有态，E_rw 与 S_rw 的形状为 (len(orders), NS)
+    """
+    if not (0.0 <= drop_ratio < 1.0):
+        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+
+    orders = np.asarray(list(orders), dtype=int)
+    steps = np.asarray(trace["steps"], dtype=int)
+    S_arr = state_data(trace["S"], state)
+    E_arr = state_data(trace["E"], state)
+    norm_arr = state_data(trace["norm"], state)
+    Nw_arr = state_data(trace["Nw"], state)
+    n = steps.size
+    interval = steps[1] - steps[0]
+
+    drop_n = int(n * drop_ratio)
+    if drop_n >= n:
+        raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
+
+    C = cal_mean(S_arr, drop_ratio)
+    ee = cal_mean(E_arr, drop_ratio) / cal_mean(norm_arr, drop_ratio)
+    print(f"Reweighting parameters: <S> = {C}, <E> = {ee}")
+    prefix = cal_S_prefix(S_arr, interval)
+
+    # 同一个 order 的权重只算一次，order + 10 与后面的 order 重合时直接复用
+    factors = {}
+
+    def get_factor(order):
+        if order not in factors:
+            factors[order] = _reweight_factor(
+                steps, S_arr, dtau, order, drop_n, interval, C, prefix=prefix
+            )
+        return factors[order]
+
+    E_rw = np.full((orders.size,) + np.shape(C), np.nan)
+    S_rw = np.full((orders.size,) + np.shape(C), np.nan)
+    for i, order in enumerate(orders):
+        try:
+            start_idx, W = get_factor(order)
+            E_rw[i] = cal_reweight_energy(E_arr, norm_arr, start_idx, W)
+            start_idx_n1, W_n1 = get_factor(order + 10)
+            S_rw[i] = _reweight_S(
+                steps, Nw_arr, C, dtau, interval, start_idx, W, start_idx_n1, W_n1
+            )
+        except ValueError as e:
+            print(f"order = {order}: {e}")
+
+    return orders, E_rw, S_rw
@@ -0,0 +1,278 @@
+"""
+比内存大的 trace 文件的流式分析
+
+按固定大小的块读取 trace，每块解析后按态拆开，送进每个态的累加器，读完即丢弃：
+    均值与块分析  BlockingAccumulator，内存 O(log N)
+    growth estimator  只需要上一行的 S 与 Nw
+    重加权  窗口 [step - order, step - 1] 的 S 之和只用到前 order / A 行，
+            每个态保留这么多行的 S 接在下一块前面，用 sum_S_windows 计算
+块大小由内存上限决定，内存占用与文件大小无关。压缩的 trace 边读边解压。
+
+丢弃的行数由 step 网格（第一行、最后一行与间隔）确定，要求 step 等距，
+读完后检查每个态的行数与网格一致。
+重加权的平移量 C 是丢弃后 S 的均值，要读完才知道，这里先用每个态丢弃后第一行的 S 作为 C0，
+窗口长度固定，W 只差一个常数因子 exp(dtau * order * (C - C0))，最后精确地修正回来，
+因此只需要读一遍文件。
+"""
+
+import os
+import re
+
+import numpy as np
+
+from .analysis import INPUT_DTAU, REWEIGHT_ORDER_E, REWEIGHT_ORDER_S
+from .archive import is_archive
+from .block import BlockingAccumulator, plateau_error
+from .compression import is_compressed, open_trace
+from .read_file import (
+    NORMAL_COLUMNS,
+    REPLICA_COLUMNS,
+    detect_trace_type,
+    iter_trace_chunks,
+    trace_dtype,
+    _parse_chunk,
+)
+from .reweight_tools import compute_dtau, sum_S_windows
+
+MEMORY_LIMIT = 1 << 30
+# 一块文本在解析、按态拆分与计算时大约同时存在的份数，块大小取内存上限除以它
+CHUNK_COPIES = 8
+MIN_CHUNK_SIZE = 1 << 16
+# 读取最后一行时从结尾往前取的字节数
+TAIL_BYTES = 4096
+# cal_reweight_S 中 order 与 order + 10 两组权重
+REWEIGHT_S_OFFSET = 10
+
+
+# 解析 "512M"、"2G"、"1048576" 这样的内存大小，返回字节数
+def parse_size(text):
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([kKmMgGtT]?)[bB]?\s*", str(text))
+    if match is None:
+        raise ValueError(f"无法识别的内存大小: {text}，例如 512M、2G")
+    scale = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+    return int(float(match.group(1)) * scale[match.group(2).lower()])
+
+
+# 内存上限对应的读取块大小
+def chunk_size_for(memory_limit):
+    return max(MIN_CHUNK_SIZE, int(memory_limit) // CHUNK_COPIES)
+
+
+# 从文件开头的一块与结尾的一行得到 step 网格 (第一个 step, 间隔, 每个态的行数)
+# 压缩文件不能直接跳到结尾，要顺序解压一遍，只保留最后 TAIL_BYTES 字节
+def step_grid(filename, dtype, chunk_size):
+    with open_trace(filename) as f:
+        head = f.read(chunk_size)
+        if is_compressed(filename):
+            tail = head[-TAIL_BYTES:]
+            for block in iter(lambda: f.read(chunk_size), b""):
+                tail = (tail + block[-TAIL_BYTES:])[-TAIL_BYTES:]
+        else:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+        head = head[: head.rfind(b"\n") + 1]
+        tail = tail.rstrip()
+    first = _parse_chunk(head, dtype)
+    last = _parse_chunk(tail[tail.rfind(b"\n") + 1 :], dtype)
+    steps = np.unique(first["step"])
+    if first.size == 0 or last.size == 0 or steps.size < 2:
+        raise ValueError("trace 文件太短，无法确定 step 间隔。")
+    interval = int(steps[1] - steps[0])
+    nsteps = int(last["step"][-1] - steps[0]) // interval + 1
+    return int(steps[0]), interval, nsteps
+
+
+# 一个态的流式累加器
+class _StateStream:
+    def __init__(self, columns, drop_n, reweight=None):
+        self.columns = columns
+        self.drop_n = drop_n
+        self.rows = 0
+        # 丢弃后的 E、norm、J2（以及 S）一起分块
+        self.observables = [c for c in ("E", "norm", "J2", "S") if c in columns]
+        self.acc = BlockingAccumulator(len(self.observables))
+        self.has_S = "S" in columns
+        if self.has_S:
+            self.egr = BlockingAccumulator(1)
+            self.prev = None  # 上一行的 (S, Nw)
+            self.reweight = reweight  # {order: 起始 step}
+            self.tail = None  # 保留的最后几行 (step, S)
+            self.C0 = None
+            self.sums = dict.fromkeys(("WE", "Wnorm", "WN_n", "WN_n1"), 0.0)
+            self.last_WN_n = 0.0
+
+    def feed(self, rows, dtau, interval, keep):
+        index = self.rows + np.arange(rows.size)
+        self.rows += rows.size
+        used = index >= self.drop_n
+        if np.any(used):
+            self.acc.add(np.column_stack([rows[c][used] for c in self.observables]))
+        if self.has_S:
+            self._feed_growth(rows, index, dtau, interval)
+            self._feed_reweight(rows, used, dtau, interval, keep)
+
+    # growth estimator：Egr_i = S_{i-1} - (N_i - N_{i-1}) / (A dtau N_{i-1})，i > drop_n
+    def _feed_growth(self, rows, index, dtau, interval):
+        S = rows["S"]
+        Nw = rows["Nw"]
+        if self.prev is not None:
+            S = np.concatenate([[self.prev[0]], S])
+            Nw = np.concatenate([[self.prev[1]], Nw])
+            index = np.concatenate([[index[0] - 1], index])
+        self.prev = (rows["S"][-1], rows["Nw"][-1])
+
+        Nw_prev = Nw[:-1]
+        growth = np.divide(
+            Nw[1:] - Nw_prev,
+            interval * dtau * Nw_prev,
+            out=np.zeros_like(Nw_prev),
+            where=Nw_prev != 0,
+        )
+        Egr = np.where(Nw_prev != 0, S[:-1] - growth, 0.0)
+        Egr = Egr[index[1:] > self.drop_n]
+        if Egr.size:
+            self.egr.add(Egr)
+
+    # 重加权：对每个 order 的新行计算 W0 = exp(-dtau * sum(S - C0))，累加加权和
+    def _feed_reweight(self, rows, used, dtau, interval, keep):
+        if self.C0 is None and np.any(used):
+            self.C0 = rows["S"][used][0]
+        steps = rows["step"]
+        S = rows["S"]
+        new = rows.size
+        if self.tail is not None:
+            steps = np.concatenate([self.tail[0], steps])
+            S = np.concatenate([self.tail[1], S])
+        self.tail = (steps[-keep:], S[-keep:])
+        if self.C0 is None:
+            return
+
+        fresh = slice(steps.size - new, None)
+        E, norm, Nw = rows["E"], rows["norm"], rows["Nw"]
+        for order, start_step in self.reweight.items():
+            target = steps[fresh] >= start_step
+            if not np.any(target):
+                continue
+            t = steps[fresh][target]
+            sum_S = sum_S_windows(S, steps, t - order, t - 1, interval, C=self.C0)
+            W0 = np.exp(-dtau * sum_S)
+            if order == REWEIGHT_ORDER_E:
+                self.sums["WE"] += np.sum(W0 * E[target])
+                self.sums["Wnorm"] += np.sum(W0 * norm[target])
+            if order == REWEIGHT_ORDER_S:
+                WN = W0 * Nw[target]
+                self.sums["WN_n"] += np.sum(WN)
+                self.last_WN_n = WN[-1]
+            if order == REWEIGHT_ORDER_S + REWEIGHT_S_OFFSET:
+                self.sums["WN_n1"] += np.sum(W0 * Nw[target])
+
+    # 汇总结果，键与 analysis.analyze_trace 相同
+    def result(self, dtau, interval):
+        col = {name: i for i, name in enumerate(self.observables)}
+        n = self.acc.n
+        mean = self.acc.mean()
+        result = {
+            "rows": self.rows,
+            "E": mean[col["E"]] / mean[col["norm"]],
+            "J2": mean[col["J2"]] / mean[col["norm"]],
+            "E_err": plateau_error(
+                self.acc.ratio_block_errors(col["E"], col["norm"])[0], n
+            ),
+            "J2_err": plateau_error(
+                self.acc.ratio_block_errors(col["J2"], col["norm"])[0], n
+            ),
+        }
+        if not self.has_S:
+            return result
+
+        C = mean[col["S"]]
+        result["S"] = C
+        result["S_err"] = plateau_error(self.acc.block_errors(col["S"])[0], n)
+        result["Egr"] = self.egr.mean()[0]
+        result["E_rw"] = self.sums["WE"] / self.sums["Wnorm"]
+        # W 与 W0 只差常数因子，两组权重的窗口相差 REWEIGHT_S_OFFSET 步
+        ratio = self.sums["WN_n1"] / (self.sums["WN_n"] - self.last_WN_n)
+        shift = dtau * REWEIGHT_S_OFFSET * (C - self.C0)
+        result["S_rw"] = C - (np.log(ratio) + shift) / (interval * dtau)
+        return result
+
+
+# 流式分析一个 trace 文件的所有态，返回每个态一个 dict 的列表，与 analyze_trace 的结果对应
+def stream_analysis(
+    filename, drop_ratio=0.3, input_dtau=INPUT_DTAU, memory_limit=MEMORY_LIMIT
+):
+    """
+    memory_limit: 内存上限（字节），决定每次读取的块大小
+    结果中的块分析误差用从开头对齐的块（见 BlockingAccumulator），与读入内存的结果略有差别
+    """
+    if not (0.0 <= drop_ratio < 1.0):
+        raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+
+    if is_archive(filename):
+        raise ValueError("归档文件直接内存映射读取，不需要 --out-of-core")
+    trace_type = detect_trace_type(filename)
+    columns = REPLICA_COLUMNS if trace_type == "replica" else NORMAL_COLUMNS
+    chunk_size = chunk_size_for(memory_limit)
+    first_step, interval, nsteps = step_grid(filename, trace_dtype(columns), chunk_size)
+    drop_n = int(nsteps * drop_ratio)
+    if drop_n >= nsteps:
+        raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
+    dtau = compute_dtau(input_dtau)
+
+    # 与 _reweight_factor 相同的起始 step
+    cut_step = first_step + drop_n * interval
+    orders = (REWEIGHT_ORDER_E, REWEIGHT_ORDER_S, REWEIGHT_ORDER_S + REWEIGHT_S_OFFSET)
+    reweight = {o: -(-(cut_step + o) // interval) * interval for o in orders}
+    last_step = first_step + (nsteps - 1) * interval
+    keep = max(orders) // interval + 2
+
+    states = {}
+    with open_trace(filename) as f:
+        for chunk in iter_trace_chunks(f, columns, chunk_size):
+            sidx = chunk["sidx"]
+            for k in np.unique(sidx):
+                if k not in states:
+                    states[k] = _StateStream(columns, drop_n, reweight)
+                states[k].feed(chunk[sidx == k], dtau, interval, keep)
+
+    rows = []
+    for i, k in enumerate(sorted(states)):
+        stream = states[k]
+        row = {"state": i, "type": trace_type}
+        if stream.rows != nsteps:
+            row["status"] = (
+                f"态 {k} 有 {stream.rows} 行，与 step 网格的 {nsteps} 步不一致，"
+                "step 不等距的 trace 请读入内存分析"
+            )
+            rows.append(row)
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            row.update(stream.result(dtau, interval))
+        failed = []
+        if stream.has_S:
+            for name, order in (("E_rw", REWEIGHT_ORDER_E), ("S_rw", REWEIGHT_ORDER_S)):
+                if reweight[order] > last_step:
+                    row[name] = np.nan
+                    failed.append(
+                        f"{name}: 丢弃数据后，剩余数据无法满足给定 order = {order} 的计算。"
+                    )
+            start_n1 = reweight[REWEIGHT_ORDER_S + REWEIGHT_S_OFFSET]
+            if start_n1 != reweight[REWEIGHT_ORDER_S] + interval:
+                row["S_rw"] = np.nan
+                failed.append(
+                    "S_rw: start_idx_n1 对应的 step 应该比 start_idx_n 多一个间隔。"
+                )
+        row["status"] = "; ".join(failed) if failed else "ok"
+        rows.append(row)
+    return rows
+
+
+# 命令行 --out-of-core 用：流式分析所有态，返回第 state 个态的结果，失败的原因在 "status" 中
+def stream_state(
+    filename, state, drop_ratio, memory_limit=MEMORY_LIMIT, input_dtau=INPUT_DTAU
+):
+    if drop_ratio == "auto":
+        raise ValueError("--out-of-core 不支持 --start auto，请给出丢弃比例")
+    rows = stream_analysis(filename, drop_ratio, input_dtau, memory_limit)
+    return rows[state]
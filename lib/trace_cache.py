@@ -0,0 +1,122 @@
+"""
+trace 文件的二进制缓存
+
+解析一次 trace 文本后，把每个观测量按 (态, step) 存成 .npy 放在 trace 文件旁边的
+<trace>.cache/ 目录里，下次读取时直接用 np.load(mmap_mode="r") 内存映射，不再解析文本。
+缓存用 (绝对路径, 文件大小, mtime) 作为键，trace 文件变化后自动失效重建。
+只读取了部分观测量时只缓存这些，之后读取其他观测量时补进同一个缓存。
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .trace_data import Trace
+
+CACHE_VERSION = 1
+
+
+def cache_dir(filename):
+    return filename + ".cache"
+
+
+# 文件的缓存键：绝对路径、大小与修改时间，log 的段索引缓存也用它
+def cache_key(filename):
+    st = os.stat(filename)
+    return {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(filename),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+# 读取 trace 文件的缓存，有效并且 meta 的键与文件一致时返回 meta，否则返回 None
+def _load_meta(filename):
+    meta_file = os.path.join(cache_dir(filename), "meta.json")
+    if not os.path.isfile(meta_file):
+        return None
+    try:
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    key = cache_key(filename)
+    if any(meta.get(k) != v for k, v in key.items()):
+        return None
+    return meta
+
+
+# 读取缓存，缓存不存在、已失效或缺少需要的观测量时返回 None
+def load_trace_cache(filename, observables=None):
+    """
+    observables: 需要的观测量，None 表示 trace 文件中的全部观测量
+    返回
+    ----
+    (trace, trace_type) 或 None
+        trace 是 Trace，每个观测量是 (NS, nsteps) 的只读内存映射数组，trace["E"][state] 用法不变
+    """
+    meta = _load_meta(filename)
+    if meta is None:
+        return None
+
+    # 旧的缓存没有 "observables"，那时总是缓存全部观测量
+    available = meta.get("observables", [k for k in meta["keys"] if k != "steps"])
+    if observables is not None:
+        available = [name for name in available if name in observables]
+    if any(name not in meta["keys"] for name in available):
+        return None
+
+    directory = cache_dir(filename)
+    trace = {}
+    try:
+        for name in ["steps"] + available:
+            trace[name] = np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+
+    steps = trace.pop("steps")
+    return Trace(steps, trace, meta["trace_type"]), meta["trace_type"]
+
+
+# 写入缓存，各个态长度不同或目录不可写时放弃缓存，不影响正常读取
+# observables 是 trace 文件中的全部观测量，trace 只有其中一部分时与已有的缓存合并
+def save_trace_cache(filename, trace, trace_type, observables=None):
+    if observables is None:
+        observables = [name for name in trace.keys() if name != "steps"]
+    arrays = {}
+    for name, value in trace.items():
+        if name == "steps":
+            arrays[name] = np.asarray(value)
+            continue
+        lengths = {len(v) for v in value}
+        if len(lengths) > 1:
+            print("各个态的数据长度不同，不写入 trace 缓存。")
+            return False
+        arrays[name] = np.asarray(value, dtype=float)
+
+    # 已有的有效缓存中其他观测量保留
+    old = _load_meta(filename)
+    kept = [] if old is None else [k for k in old["keys"] if k not in arrays]
+
+    directory = cache_dir(filename)
+    meta_file = os.path.join(directory, "meta.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # 先删掉旧的 meta，写入中途失败时缓存不会被当成有效
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        for name, arr in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), arr)
+        meta = cache_key(filename)
+        meta["trace_type"] = trace_type
+        meta["observables"] = list(observables)
+        meta["keys"] = list(arrays) + kept
+        with open(meta_file, "w") as f:
+            json.dump(meta, f, indent=2)
+    except OSError as e:
+        print(f"写入 trace 缓存失败: {e}")
+        return False
+
+    return True
@@ -0,0 +1,113 @@
+"""
+trace 数据的容器
+
+每个观测量存成一个连续的 (NS, nsteps) 数组，另外记录 step 网格、步长间隔与 trace 类型。
+trace["E"][state] 这样的字典式访问保持不变；state() 与 window() 返回原数组的视图，不复制数据。
+各个态的数据长度不同时，观测量退回为每个态一个数组的列表。
+"""
+
+import numpy as np
+
+
+class Trace:
+    __slots__ = ("steps", "interval", "trace_type", "_data")
+
+    def __init__(self, steps, data, trace_type="normal"):
+        """
+        steps: 一维的 step 网格
+        data: {观测量名: (NS, nsteps) 数组，或每个态一个数组的列表}
+        trace_type: "normal" 或 "replica"
+        """
+        self.steps = np.asarray(steps)
+        self.interval = int(self.steps[1] - self.steps[0]) if self.steps.size > 1 else 0
+        self.trace_type = trace_type
+        self._data = {}
+        for name, value in data.items():
+            if isinstance(value, np.ndarray) and value.ndim == 2:
+                self._data[name] = value
+            else:
+                self._data[name] = [np.asarray(v) for v in value]
+
+    # 从旧的 dict 形式的 trace 构造
+    @classmethod
+    def from_mapping(cls, trace, trace_type="normal"):
+        if isinstance(trace, cls):
+            return trace
+        data = {name: value for name, value in trace.items() if name != "steps"}
+        return cls(trace["steps"], data, trace_type)
+
+    # --- 字典式访问 ---
+    def __getitem__(self, name):
+        if name == "steps":
+            return self.steps
+        return self._data[name]
+
+    def __contains__(self, name):
+        return name == "steps" or name in self._data
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._data) + 1
+
+    def keys(self):
+        return ["steps"] + list(self._data)
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def __repr__(self):
+        return (
+            f"Trace({self.trace_type}, states={self.nstates}, steps={self.nsteps}, "
+            f"observables={self.observables})"
+        )
+
+    @property
+    def observables(self):
+        return list(self._data)
+
+    @property
+    def nstates(self):
+        return len(next(iter(self._data.values()), []))
+
+    @property
+    def nsteps(self):
+        return self.steps.size
+
+    # 各个态的数据长度是否相同，相同时每个观测量都是 (NS, nsteps) 数组
+    @property
+    def is_rectangular(self):
+        return all(isinstance(v, np.ndarray) for v in self._data.values())
+
+    # 长度为 n 的数据按 drop_ratio 丢弃的点数
+    @staticmethod
+    def drop_n(n, drop_ratio):
+        if not (0.0 <= drop_ratio < 1.0):
+            raise ValueError("drop_ratio 必须在 [0, 1) 范围内，例如 0.2 表示丢弃前 20%")
+        if n == 0:
+            raise ValueError("data 为空，无法计算平均值。")
+        drop_n = int(n * drop_ratio)
+        if drop_n >= n:
+            raise ValueError("丢弃的点数不少于总长度，无法计算平均值。")
+        return drop_n
+
+    # 某个态某个观测量丢弃前 drop_ratio 比例后的视图
+    def state(self, name, state=0, drop_ratio=0.0):
+        arr = self._data[name][state]
+        return arr[self.drop_n(len(arr), drop_ratio) :]
+
+    # 丢弃前 drop_ratio 比例后的 Trace，state 为 None 时保留所有态，数据都是视图
+    def window(self, drop_ratio=0.0, state=None):
+        if not self.is_rectangular:
+            raise ValueError("各个态的数据长度不同，无法取统一的窗口。")
+        drop_n = self.drop_n(self.nsteps, drop_ratio)
+        rows = slice(None) if state is None else slice(state, state + 1)
+        data = {name: arr[rows, drop_n:] for name, arr in self._data.items()}
+        return Trace(self.steps[drop_n:], data, self.trace_type)
@@ -1,3 +1,7 @@
+import csv
+import json
+import sys
+
 import numpy as np
 
 
@@ -45,3 +49,47 @@ def save_to_file(filename, *arrays, fmt, delimiter=",", header=None):
 
     except Exception as e:
         print(f"写入文件时出错: {e}")
+
+
+# 把 numpy 的数与数组转成 json 能写的类型，nan 写成 null
+def _to_builtin(value):
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+# 把每行一个 dict 的结果写成 csv 表，各行的键取并集，status 列放在最后
+# filename 为 None 时写到标准输出
+def save_table(filename, rows):
+    fields = []
+    for row in rows:
+        for key in row:
+            if key not in fields and key != "status":
+                fields.append(key)
+    if any("status" in row for row in rows):
+        fields.append("status")
+
+    f = sys.stdout if filename is None else open(filename, "w", newline="")
+    try:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(_to_builtin(rows))
+    finally:
+        if filename is not None:
+            f.close()
+
+
+# 写 json，filename 为 None 时写到标准输出
+def save_json(filename, data):
+    text = json.dumps(_to_builtin(data), indent=2, ensure_ascii=False)
+    if filename is None:
+        print(text)
+        return
+    with open(filename, "w") as f:
+        f.write(text + "\n")
@@ -1,42 +1,28 @@
-import re
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 
+from lib.log_sections import read_section_walkers
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Plot FCIQMC1 warm-up walker numbers (log y by default)."
-    )
+
+def add_arguments(parser):
     parser.add_argument("file", help="Path to log file")
     parser.add_argument("--end", type=int, default=None, help="Only plot steps <= end")
-    args = parser.parse_args()
-
-    with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
-        s = f.read()
-
-    # only fciqmc1 section
-    i0 = s.find("warm up for fciqmc1")
-    i1 = s.find("warm up for fciqmc2", i0)
-    if i0 < 0:
-        raise SystemExit("Cannot find 'warm up for fciqmc1' in log.")
-    if i1 < 0:
-        i1 = len(s)
-    s = s[i0:i1]
-
-    # extract (step, walker)
-    pattern = re.compile(
-        r"step:\s*(\d+),\s*walker number:\s*([+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)"
+    parser.add_argument(
+        "--section", default="fciqmc1", help="Warm-up section name (default fciqmc1)"
     )
-    pairs = pattern.findall(s)
-    if not pairs:
+
+
+def main(args):
+    # 段的位置索引会缓存在 log 旁边，只读取需要的这一段
+    try:
+        steps, walkers = read_section_walkers(args.file, args.section)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if steps.size == 0:
         raise SystemExit(
-            "No 'step: ..., walker number: ...' lines found in fciqmc1 section."
+            f"No 'step: ..., walker number: ...' lines found in {args.section} section."
         )
 
-    steps = np.fromiter((int(a) for a, _ in pairs), dtype=np.int64)
-    walkers = np.fromiter((float(b) for _, b in pairs), dtype=np.float64)
-
     # optional truncate
     if args.end is not None:
         mask = steps <= args.end
@@ -46,14 +32,20 @@ def main():
     mask = walkers > 0
     steps, walkers = steps[mask], walkers[mask]
 
+    import matplotlib.pyplot as plt
+
     plt.plot(steps, walkers)
     plt.yscale("log")  # 默认对数纵坐标
     plt.xlabel("step")
     plt.ylabel("walker number")
-    plt.title("FCIQMC1 warm up (log y)")
+    plt.title(f"{args.section.upper()} warm up (log y)")
     plt.tight_layout()
     plt.show()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Plot FCIQMC warm-up walker numbers (log y by default)."
+    )
+    add_arguments(parser)
+    main(parser.parse_args())
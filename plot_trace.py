@@ -16,9 +16,9 @@ dtau = 1e-4
 dtau = compute_dtau(dtau)
 
 # 提取数据
-S_data = trace["S"][state]
-E_data = trace["E"][state]
-norm_data = trace["norm"][state]
+S_data = trace.state("S", state)
+E_data = trace.state("E", state)
+norm_data = trace.state("norm", state)
 times = trace["steps"] * dtau
 
 # 防止除以0警告
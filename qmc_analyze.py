@@ -0,0 +1,54 @@
+import argparse
+import importlib.util
+import os
+import sys
+
+"""
+统一的命令行入口，子命令对应各个分析脚本：
+    qmc_analyze.py trace    ...  同 trace.py
+    qmc_analyze.py reweight ...  同 reweight.py
+    qmc_analyze.py replica  ...  同 replica_log.py
+    qmc_analyze.py plateau  ...  同 plot_plateau.py
+    qmc_analyze.py batch    ...  同 batch.py
+    qmc_analyze.py archive  ...  同 archive.py
+只导入所选子命令的脚本，matplotlib 只在画图时导入，只算一个数时启动更快
+"""
+
+COMMANDS = {
+    "trace": ("trace.py", "Trace file analysis"),
+    "reweight": ("reweight.py", "Reweighting analysis of trace files"),
+    "replica": ("replica_log.py", "Replica log analysis"),
+    "plateau": ("plot_plateau.py", "Plot warm-up walker numbers"),
+    "batch": ("batch.py", "Batch analysis of many trace files"),
+    "archive": ("archive.py", "Convert trace files to columnar archives"),
+}
+
+
+# 按路径导入子命令脚本，避免 trace.py 与标准库的 trace 模块重名
+def load_command(name):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMMANDS[name][0])
+    spec = importlib.util.spec_from_file_location(f"qmc_{name}", script)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="FCIQMC analysis tool",
+        epilog="Run '%(prog)s <command> -h' for the options of a command.",
+    )
+    parser.add_argument("command", choices=list(COMMANDS), help="Subcommand to run")
+    top = parser.parse_args(argv[:1])
+
+    module = load_command(top.command)
+    sub = argparse.ArgumentParser(
+        prog=f"{parser.prog} {top.command}", description=COMMANDS[top.command][1]
+    )
+    module.add_arguments(sub)
+    module.main(sub.parse_args(argv[1:]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
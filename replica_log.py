@@ -2,17 +2,15 @@ import argparse
 import os
 
 from lib.read_file import *
-from lib.plot import *
 from lib.replica_tools import *
 
 """
 读取并解析 replica 的 log 文件，不处理 trace 文件
-暂时只支持 NS = 1，没写多个态
+支持多个态，state 是态的序号
 """
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Log analysis tool")
 
+def add_arguments(parser):
     # 三个位置参数：file, state(可选，默认0), mode
     parser.add_argument("file", help="Path to log file")
     parser.add_argument(
@@ -30,13 +28,19 @@ if __name__ == "__main__":
 
     # start 是数据的前多少百分比要扔掉，默认值设为 0.3
     parser.add_argument("--start", type=float, default=0.3, help="Start step")
+    # 每隔多少个记录取一个，大于 1 时按原来的写法从第 10 个记录开始取
+    parser.add_argument(
+        "--interval", type=int, default=1, help="Keep one record every N records"
+    )
 
-    args = parser.parse_args()
 
+def main(args):
     filename = args.file
 
-    log = read_replica_log(filename)
-    # log = read_replica_log_interval(filename)
+    if args.interval > 1:
+        log = read_replica_log_interval(filename, args.interval, state=args.state)
+    else:
+        log = read_replica_log(filename, state=args.state)
 
     if args.mode == "ee":
         ee = replica_mean(log["E"], args.start)
@@ -54,3 +58,9 @@ if __name__ == "__main__":
 
     else:
         raise ValueError(f"未知的 mode: {args.mode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log analysis tool")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,18 +1,45 @@
 import argparse
 import os
 
+import numpy as np
+
 from lib.read_file import *
 from lib.cal import *
 from lib.reweight_tools import *
 from lib.estimator import *
+from lib.equilibration import parse_start, resolve_drop_ratio, with_equilibration
+from lib.resample import N_RESAMPLES, resample_analysis
+from lib.stream import MEMORY_LIMIT, parse_size, stream_state
+from lib.write_file import save_to_file
 
 """ 
 本主函数进行 reweight 计算 S 或 E 的修正，也可以进行块分析
 """
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Log analysis tool")
+# 每个模式用到的观测量，读取 trace 时只解析这些列，None 表示全部
+# cal_reweight_factor 会打印 <E>，因此重加权的模式都需要 E 与 norm
+MODE_OBSERVABLES = {
+    "reweight_e": ("S", "E", "norm"),
+    "reweight_s": ("S", "Nw", "E", "norm"),
+    "Egr": ("S", "Nw"),
+    "sweep": ("S", "Nw", "E", "norm"),
+    "Egr_sweep": ("S", "Nw"),
+    "resample": None,
+}
+
+
+# 解析 --orders，支持 "100,200,500" 与 "start:stop:step"（含 stop）两种写法
+def parse_orders(text):
+    if ":" in text:
+        parts = [int(x) for x in text.split(":")]
+        if len(parts) == 2:
+            parts.append(10)
+        start, stop, step = parts
+        return list(range(start, stop + 1, step))
+    return [int(x) for x in text.split(",") if x.strip()]
+
 
+def add_arguments(parser):
     # 三个位置参数：file, state(可选，默认0), mode
     parser.add_argument("file", help="Path to log file")
     parser.add_argument(
@@ -24,21 +51,96 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "mode",
-        choices=["reweight_s", "reweight_e", "Egr"],
+        choices=["reweight_s", "reweight_e", "Egr", "sweep", "Egr_sweep", "resample"],
         help="Which function to run",
     )
 
     # start 不是位置参数，因为有 --，用 --start 写，可以不提供
     # 而位置参数必须提供
-    parser.add_argument("--start", type=float, default=0.3, help="Start step")
+    parser.add_argument(
+        "--start",
+        type=parse_start,
+        default=0.3,
+        help='Drop ratio of the burn-in, or "auto" to detect equilibration',
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use the binary trace cache"
+    )
+    # 比内存大的 trace 文件：按块流式读取，不把整个文件读入内存
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="Stream the trace in chunks instead of loading it into memory",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=parse_size,
+        default=MEMORY_LIMIT,
+        help='Memory ceiling for --out-of-core, e.g. "512M" or "4G"',
+    )
+    # sweep 模式用的 order 列表与输出文件
+    parser.add_argument(
+        "--orders",
+        default="500:5000:500",
+        help='Orders for sweep mode, "100,200,500" or "start:stop:step"',
+    )
+    parser.add_argument(
+        "--output", default=None, help="Output file for sweep and Egr_sweep modes"
+    )
+    # Egr_sweep 模式的 lag 列表
+    parser.add_argument(
+        "--lags",
+        default="1,2,5,10,20,50,100",
+        help='Lags for Egr_sweep mode, "1,2,5" or "start:stop:step"',
+    )
+    # resample 模式的参数
+    parser.add_argument(
+        "--method",
+        choices=["bootstrap", "jackknife"],
+        default="bootstrap",
+        help="Resampling method for resample mode",
+    )
+    parser.add_argument(
+        "--resamples",
+        type=int,
+        default=N_RESAMPLES,
+        help="Number of bootstrap resamples",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Threads for bootstrap resampling"
+    )
 
-    args = parser.parse_args()
 
+def main(args):
     filename = args.file
     if not os.path.isfile(filename):
         raise FileNotFoundError(f"文件不存在: {filename}")
 
-    trace, type = read_trace_auto(filename)
+    if args.out_of_core:
+        # 流式计算重加权 E、S 与 growth estimator，内存不超过 --memory-limit
+        names = {
+            "reweight_e": ("E_rw", "Reweighted E"),
+            "reweight_s": ("S_rw", "Reweighted S"),
+            "Egr": ("Egr", "Growth estimator Egr"),
+        }
+        if args.mode not in names:
+            raise ValueError(f"--out-of-core 不支持 {args.mode} 模式")
+        key, label = names[args.mode]
+        row = stream_state(filename, args.state, args.start, args.memory_limit)
+        if row["type"] == "replica":
+            raise ValueError("replica trace 文件中没有 S 数据，无法重加权")
+        # 态的行数与 step 网格不一致、order 超出数据等失败时结果中没有这个量或为 NaN
+        if row["status"] != "ok" and not np.isfinite(row.get(key, np.nan)):
+            raise ValueError(row["status"])
+        print(f"{label} (dropping {args.start*100:.1f}%) = {row[key]}")
+        return
+
+    observables = with_equilibration(MODE_OBSERVABLES[args.mode], args.start)
+    trace, type = read_trace_auto(
+        filename, use_cache=not args.no_cache, observables=observables
+    )
+    args.start = resolve_drop_ratio(args.start, trace, args.state)
 
     if args.mode == "reweight_e":
         # 计算 E 的重加权量
@@ -49,7 +151,7 @@ if __name__ == "__main__":
             trace, dtau, order, drop_ratio=args.start, state=args.state
         )
         reweighted_E = cal_reweight_energy(
-            trace["E"][args.state], trace["norm"][args.state], start_idx, W
+            trace.state("E", args.state), trace.state("norm", args.state), start_idx, W
         )
         print(f"Reweighted E (dropping {args.start*100:.1f}%) = {reweighted_E}")
 
@@ -70,5 +172,79 @@ if __name__ == "__main__":
         Egr = cal_growth_estimator(trace, dtau, drop_ratio=args.start, state=args.state)
         print(f"Growth estimator Egr (dropping {args.start*100:.1f}%) = {Egr}")
 
+    elif args.mode == "sweep":
+        # 扫描多个 order 的重加权 E 与 S
+        input_dtau = 0.0001  # FCIQMC 输入的 dtau
+        dtau = compute_dtau(input_dtau)
+        orders = parse_orders(args.orders)
+        orders, E_rw, S_rw = cal_reweight_sweep(
+            trace, dtau, orders, drop_ratio=args.start, state=args.state
+        )
+        print(f"Reweighting sweep (dropping {args.start*100:.1f}%):")
+        print(f"{'order':>8} {'E':>16} {'S':>16}")
+        for order, e, s in zip(orders, E_rw, S_rw):
+            print(f"{order:>8d} {e:>16.8f} {s:>16.8f}")
+        if args.output is not None:
+            save_to_file(
+                args.output,
+                orders,
+                E_rw,
+                S_rw,
+                fmt=["%d", "%.10f", "%.10f"],
+                header="# order, E, S",
+            )
+
+    elif args.mode == "Egr_sweep":
+        # 扫描多个 lag 的 growth estimator 与块分析误差
+        input_dtau = 0.0001  # FCIQMC 输入的 dtau
+        dtau = compute_dtau(input_dtau)
+        lags, Egr, Egr_err = cal_growth_estimator_sweep(
+            trace,
+            dtau,
+            parse_orders(args.lags),
+            drop_ratio=args.start,
+            state=args.state,
+        )
+        print(f"Growth estimator lag sweep (dropping {args.start*100:.1f}%):")
+        print(f"{'lag':>8} {'Egr':>16} {'err':>16}")
+        for lag, e, err in zip(lags, Egr, Egr_err):
+            print(f"{lag:>8d} {e:>16.8f} {err:>16.8f}")
+        if args.output is not None:
+            save_to_file(
+                args.output,
+                lags,
+                Egr,
+                Egr_err,
+                fmt=["%d", "%.10f", "%.10f"],
+                header="# lag, Egr, err",
+            )
+
+    elif args.mode == "resample":
+        # 重采样得到 E/norm、J2/norm、重加权 E 与 S、growth estimator 的误差
+        input_dtau = 0.0001  # FCIQMC 输入的 dtau
+        dtau = compute_dtau(input_dtau)
+        result = resample_analysis(
+            trace,
+            dtau,
+            drop_ratio=args.start,
+            state=args.state,
+            method=args.method,
+            n_resamples=args.resamples,
+            seed=args.seed,
+            workers=args.workers,
+        )
+        print(f"{args.method} errors (dropping {args.start*100:.1f}%):")
+        print(f"{'name':>6} {'value':>16} {'err':>14} {'block':>6}")
+        for name, r in result.items():
+            print(
+                f"{name:>6} {r['value']:>16.8f} {r['err']:>14.6e} {r['block_size']:>6d}"
+            )
+
     else:
         raise ValueError(f"未知的 mode: {args.mode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log analysis tool")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,20 +1,56 @@
 import argparse
+import contextlib
+import io
 import os
+import time
+
+import numpy as np
 
 from lib.read_file import *
-from lib.plot import *
 from lib.cal import *
+from lib.follow import TraceFollower
+from lib.analysis import analyze_trace, scan_drop_ratios
+from lib.equilibration import parse_start, resolve_drop_ratio, with_equilibration
+from lib.autocorr import autocorr_analysis
+from lib.stream import MEMORY_LIMIT, parse_size, stream_analysis, stream_state
+from lib.write_file import save_json, save_table
 
 """ 
 本主函数分析的是 trace 文件，trace 文件有两种，均支持
 一种是 replica 的总 trace 文件，文件头是 # i, replica_E, replica_J2, norm
 另一种是非 replica 的，或 replica 中每个单独记录的，文件头是 # i, Nw, S, E, J2, norm
 根据文件头选择读取哪一种
+画图的模式才导入 matplotlib，其他模式启动更快
 """
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Log analysis tool")
+# 每个模式用到的观测量，读取 trace 时只解析这些列，None 表示全部
+MODE_OBSERVABLES = {
+    "es": ("S",),
+    "ee": ("E", "norm"),
+    "ej2": ("J2", "norm"),
+    "plot_evol": ("S", "E", "norm"),
+    "plot_block_e": ("E", "norm"),
+    "plot_block_se": ("S", "E", "norm"),
+    "testlog": ("E", "J2", "norm"),
+    "report": None,
+    "scan": ("S", "E", "J2", "norm"),
+    "autocorr": None,
+}
+
+
+# 解析 --ratios，支持 "0.1,0.2,0.3" 与 "start:stop:step"（含 stop）两种写法
+def parse_ratios(text):
+    if ":" in text:
+        parts = [float(x) for x in text.split(":")]
+        if len(parts) == 2:
+            parts.append(0.05)
+        start, stop, step = parts
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return list(start + step * np.arange(count))
+    return [float(x) for x in text.split(",") if x.strip()]
+
 
+def add_arguments(parser):
     # 三个位置参数：file, state(可选，默认0), mode
     parser.add_argument("file", help="Path to log file")
     parser.add_argument(
@@ -34,68 +70,266 @@ if __name__ == "__main__":
             "plot_block_e",
             "plot_block_se",
             "testlog",
+            "follow",
+            "report",
+            "scan",
+            "autocorr",
         ],  # 暂时不写 J2 的块分析
         help="Which function to run",
     )
 
     # start 不是位置参数，因为有 --，用 --start 写，可以不提供
     # 而位置参数必须提供
-    parser.add_argument("--start", type=float, default=0.3, help="Start step")
+    parser.add_argument(
+        "--start",
+        type=parse_start,
+        default=0.3,
+        help='Drop ratio of the burn-in, or "auto" to detect equilibration',
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use the binary trace cache"
+    )
+    # 比内存大的 trace 文件：按块流式读取，不把整个文件读入内存
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="Stream the trace in chunks instead of loading it into memory",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=parse_size,
+        default=MEMORY_LIMIT,
+        help='Memory ceiling for --out-of-core, e.g. "512M" or "4G"',
+    )
+
+    # follow 模式每隔多少秒检查一次 trace 文件
+    parser.add_argument(
+        "--refresh", type=float, default=10.0, help="Refresh interval for follow mode"
+    )
 
-    args = parser.parse_args()
+    # report 模式的输出格式与文件，不给文件时输出到屏幕
+    parser.add_argument(
+        "--format", choices=["json", "csv"], default="json", help="Report format"
+    )
+    parser.add_argument("--output", default=None, help="Report output file")
 
+    # scan 模式扫描的丢弃比例
+    parser.add_argument(
+        "--ratios",
+        default="0:0.8:0.05",
+        help='Drop ratios for scan mode, "0.1,0.2,0.3" or "start:stop:step"',
+    )
+
+
+# --out-of-core：流式计算 es、ee、ej2 与 report，内存不超过 --memory-limit
+def main_out_of_core(args):
+    if args.mode == "report":
+        if args.start == "auto":
+            raise ValueError("--out-of-core 不支持 --start auto，请给出丢弃比例")
+        rows = stream_analysis(
+            args.file, drop_ratio=args.start, memory_limit=args.memory_limit
+        )
+        if args.format == "json":
+            report = {
+                "file": args.file,
+                "type": rows[0]["type"] if rows else None,
+                "drop_ratio": args.start,
+                "states": rows,
+            }
+            save_json(args.output, report)
+        else:
+            save_table(args.output, rows)
+        return
+
+    names = {"es": ("S", "Mean S"), "ee": ("E", "Mean E"), "ej2": ("J2", "Mean J2")}
+    if args.mode not in names:
+        raise ValueError(f"--out-of-core 不支持 {args.mode} 模式")
+    key, label = names[args.mode]
+    row = stream_state(args.file, args.state, args.start, args.memory_limit)
+    if key == "S" and row["type"] == "replica":
+        raise ValueError("replica trace 文件中没有 S 数据，无法计算平均 S")
+    # 态的行数与 step 网格不一致等失败时结果中没有这个量
+    if row["status"] != "ok" and not np.isfinite(row.get(key, np.nan)):
+        raise ValueError(row["status"])
+    print(f"{label} (dropping {args.start*100:.1f}%) = {row[key]}")
+
+
+def main(args):
     filename = args.file
     if not os.path.isfile(filename):
         raise FileNotFoundError(f"文件不存在: {filename}")
 
-    trace, type = read_trace_auto(filename)
+    if args.mode == "follow":
+        # 跟踪正在写入的 trace 文件，只解析新追加的行，Ctrl-C 退出
+        if args.start == "auto":
+            raise ValueError("follow 模式不支持 --start auto，请给出丢弃比例")
+        follower = TraceFollower(filename, drop_ratio=args.start)
+        try:
+            while True:
+                if follower.update() > 0:
+                    report = follower.summary(args.state)
+                    print(
+                        f"step {report['step']}: {report['used']} rows used "
+                        f"(dropped first {follower.drop_n})"
+                    )
+                    if "S" in report:
+                        print(f"  Mean S = {report['S']}")
+                    print(f"  Mean E = {report['E']}")
+                    print(f"  Mean J2 = {report['J2']}")
+                    std_errs = report["block_E"][0]
+                    print("  E block errors: " + " ".join(f"{x:.2e}" for x in std_errs))
+                time.sleep(args.refresh)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.out_of_core:
+        main_out_of_core(args)
+        return
+
+    observables = with_equilibration(MODE_OBSERVABLES[args.mode], args.start)
+    trace, type = read_trace_auto(
+        filename, use_cache=not args.no_cache, observables=observables
+    )
     is_replica = type == "replica"
+    # report、autocorr 模式逐个态检测平衡点，其他模式只用 state 一个态
+    if args.mode not in ("report", "scan", "autocorr"):
+        args.start = resolve_drop_ratio(args.start, trace, args.state)
 
     if args.mode == "es":
         # 计算 S 的平均值
         if is_replica:
             raise ValueError("replica trace 文件中没有 S 数据，无法计算平均 S")
-        es = cal_mean(trace["S"][args.state], drop_ratio=args.start)
+        es = cal_mean(trace.state("S", args.state), drop_ratio=args.start)
         print(f"Mean S (dropping {args.start*100:.1f}%) = {es}")
 
     elif args.mode == "ee":
         # 计算 E 均值除以 norm 均值
-        ee = cal_mean(trace["E"][args.state], drop_ratio=args.start)
-        enorm = cal_mean(trace["norm"][args.state], drop_ratio=args.start)
+        ee = cal_mean(trace.state("E", args.state), drop_ratio=args.start)
+        enorm = cal_mean(trace.state("norm", args.state), drop_ratio=args.start)
         print(f"Mean E (dropping {args.start*100:.1f}%) = {ee/enorm}")
 
     elif args.mode == "ej2":
         # 计算 J2 均值除以 norm 均值
-        ej2 = cal_mean(trace["J2"][args.state], drop_ratio=args.start)
-        enorm = cal_mean(trace["norm"][args.state], drop_ratio=args.start)
+        ej2 = cal_mean(trace.state("J2", args.state), drop_ratio=args.start)
+        enorm = cal_mean(trace.state("norm", args.state), drop_ratio=args.start)
         print(f"Mean J2 (dropping {args.start*100:.1f}%) = {ej2 / enorm}")
 
     elif args.mode == "plot_evol":
         # 画演化图
         if is_replica:
             raise ValueError("replica trace 文件无法画演化图")
+        from lib.plot import plot_trace
+
         plot_trace(trace, state=args.state)
 
     elif args.mode == "plot_block_e":
         # 只画 E 的块分析图
+        from lib.plot import plot_block_e
+
         plot_block_e(trace, drop_ratio=args.start, state=args.state)
 
     elif args.mode == "plot_block_se":
         # 画 S 与 E 的块分析图
         if is_replica:
             raise ValueError("replica trace 文件中没有 S 数据，无法画 S 的块分析图")
+        from lib.plot import plot_block_se
+
         plot_block_se(trace, drop_ratio=args.start, state=args.state)
 
     elif args.mode == "testlog":
         # 与处理 log 的函数比较，检查可能的错误
         ee = cal_mean(
-            trace["E"][args.state] / trace["norm"][args.state], drop_ratio=args.start
+            trace.state("E", args.state) / trace.state("norm", args.state),
+            drop_ratio=args.start,
         )
         ej2 = cal_mean(
-            trace["J2"][args.state] / trace["norm"][args.state], drop_ratio=args.start
+            trace.state("J2", args.state) / trace.state("norm", args.state),
+            drop_ratio=args.start,
         )
         print(f"Mean E (dropping {args.start*100:.1f}%) = {ee}")
         print(f"Mean J2 (dropping {args.start*100:.1f}%) = {ej2}")
 
+    elif args.mode == "report":
+        # 一次读取，计算所有态所有能算的估计量
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = analyze_trace(
+                trace, type, drop_ratio=args.start, curves=args.format == "json"
+            )
+        if args.format == "json":
+            report = {
+                "file": filename,
+                "type": type,
+                "drop_ratio": args.start,
+                "states": rows,
+            }
+            save_json(args.output, report)
+        else:
+            save_table(args.output, rows)
+
+    elif args.mode == "scan":
+        # 一次计算一组丢弃比例下的均值与块分析误差，用来选择 --start
+        with contextlib.redirect_stdout(io.StringIO()):
+            scan = scan_drop_ratios(trace, parse_ratios(args.ratios), state=args.state)
+        names = [k for k in ("S", "S_err", "E", "E_err", "J2", "J2_err") if k in scan]
+        rows = [
+            {
+                "drop_ratio": ratio,
+                "drop_n": scan["drop_n"][i],
+                **{k: scan[k][i] for k in names},
+            }
+            for i, ratio in enumerate(scan["drop_ratio"])
+        ]
+        print(f"{'ratio':>6} {'drop_n':>8} " + " ".join(f"{k:>16}" for k in names))
+        for row in rows:
+            print(
+                f"{row['drop_ratio']:>6.3f} {row['drop_n']:>8d} "
+                + " ".join(f"{row[k]:>16.8g}" for k in names)
+            )
+        if args.output is not None:
+            if args.format == "json":
+                save_json(
+                    args.output, {"file": filename, "state": args.state, "scan": rows}
+                )
+            else:
+                save_table(args.output, rows)
+
+    elif args.mode == "autocorr":
+        # 所有态各个量的积分自相关时间，均值误差可以与块分析对照
+        states = range(trace.nstates)
+        if args.start == "auto":
+            # 每个态用自己检测到的平衡点
+            results = []
+            for k in states:
+                ratio = resolve_drop_ratio(args.start, trace, k)
+                results.append(autocorr_analysis(trace, drop_ratio=ratio, state=k))
+            print("Integrated autocorrelation time (equilibration detected per state):")
+        else:
+            result = autocorr_analysis(trace, drop_ratio=args.start, state=None)
+            results = [
+                {
+                    name: {key: v[k] for key, v in r.items()}
+                    for name, r in result.items()
+                }
+                for k in states
+            ]
+            print(f"Integrated autocorrelation time (dropping {args.start*100:.1f}%):")
+        print(
+            f"{'state':>5} {'name':>5} {'tau':>12} {'tau_err':>12} "
+            f"{'window':>8} {'err':>14}"
+        )
+        for k in states:
+            for name, r in results[k].items():
+                print(
+                    f"{k:>5d} {name:>5} {r['tau']:>12.4f} {r['tau_err']:>12.4f} "
+                    f"{r['window']:>8d} {r['err']:>14.6e}"
+                )
+
     else:
         raise ValueError(f"未知的 mode: {args.mode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log analysis tool")
+    add_arguments(parser)
+    main(parser.parse_args())